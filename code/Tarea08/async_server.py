@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Modo asíncrono del microservicio de libros (gevent)
+
+Sirve la misma aplicación Flask de micro.py (mismas rutas y contratos XML)
+sobre un event loop de gevent. monkey.patch_all() vuelve cooperativos los
+sockets que usan PyMySQL, redis-py y el cliente de GCS, así que una petición
+que espera a MySQL/Redis/GCS cede el control en lugar de bloquear un hilo.
+Cada conexión es un greenlet (unos KB de memoria) en vez de un hilo.
+
+Uso:
+    python async_server.py                     # 0.0.0.0:5003
+    ASYNC_PORT=5004 ASYNC_MAX_CONNECTIONS=2000 python async_server.py
+"""
+
+from gevent import monkey
+monkey.patch_all()  # Debe ejecutarse antes de importar micro
+
+import os
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from micro import create_app, logger
+
+ASYNC_HOST = os.getenv('ASYNC_HOST', '0.0.0.0')
+ASYNC_PORT = int(os.getenv('ASYNC_PORT', '5003'))
+# Peticiones concurrentes máximas; las demás esperan en el backlog del socket
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', '1000'))
+
+
+def main():
+    server = WSGIServer((ASYNC_HOST, ASYNC_PORT), create_app(),
+                        spawn=Pool(ASYNC_MAX_CONNECTIONS), log=None)
+    logger.info("Async (gevent) server listening on %s:%s max_connections=%s",
+                ASYNC_HOST, ASYNC_PORT, ASYNC_MAX_CONNECTIONS)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark de capacidad de concurrencia: modo con hilos vs modo asíncrono
+Descripción: Hace login una vez y lanza ráfagas de peticiones GET con niveles
+crecientes de concurrencia contra un endpoint protegido. Para cada nivel
+reporta throughput, latencias p50/p99 y tasa de errores. Ejecutarlo contra
+ambos modos en la misma máquina permite comparar cuántas peticiones en vuelo
+soporta cada uno antes de degradarse (ver README.md).
+
+Uso:
+    python bench_concurrency.py --url http://localhost:5003 \\
+        --username libros --password secreto \\
+        --levels 10,50,100,200,500 --requests-per-level 2000 --path /api/books
+"""
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def login(url, username, password):
+    resp = requests.post(f"{url}/api/auth/login",
+                         json={"username": username, "password": password}, timeout=30)
+    if resp.status_code != 200:
+        sys.exit(f"❌ Login falló ({resp.status_code}): {resp.text}")
+    return resp.json()["access_token"]
+
+
+def run_level(url, path, token, concurrency, total, timeout):
+    local = threading.local()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def one(_):
+        # Una sesión por hilo para reutilizar conexiones (keep-alive)
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            resp = local.session.get(f"{url}{path}", headers=headers, timeout=timeout)
+            ok = resp.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(lat for _, lat in results)
+    errors = sum(1 for ok, _ in results if not ok)
+    return {
+        "rps": total / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[max(0, int(len(latencies) * 0.99) - 1)],
+        "error_rate": errors / total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5003")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--path", default="/api/books")
+    parser.add_argument("--levels", default="10,50,100,200,500",
+                        help="Niveles de concurrencia separados por comas")
+    parser.add_argument("--requests-per-level", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    token = login(args.url, args.username, args.password)
+    print(f"📊 {args.url}{args.path}")
+    print(f"{'concurrencia':>12} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errores':>8}")
+    for level in [int(x) for x in args.levels.split(",") if x.strip()]:
+        r = run_level(args.url, args.path, token, level, args.requests_per_level, args.timeout)
+        print(f"{level:>12} {r['rps']:>9.1f} {r['p50'] * 1000:>8.0f} "
+              f"{r['p99'] * 1000:>8.0f} {r['error_rate'] * 100:>7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
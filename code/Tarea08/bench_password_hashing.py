@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark de hashing de contraseñas (PBKDF2) vs número de núcleos
+Descripción: Mide cuántas verificaciones de contraseña por segundo se logran
+con un pool de procesos de 1..N workers, que es el costo dominante de
+/api/auth/login. Opcionalmente mide el login real contra el servicio.
+
+Uso:
+    # Solo CPU: check_password_hash con pools de 1..os.cpu_count() procesos
+    python bench_password_hashing.py --iterations 600000 --requests 200
+
+    # Login real contra el servicio (el usuario debe existir)
+    python bench_password_hashing.py --url http://localhost:5003 \\
+        --username libros --password secreto --concurrency 50 --requests 500
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+def bench_pool(workers, pw_hash, password, total):
+    """Devuelve verificaciones por segundo con `workers` procesos"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Calentamiento: arranca todos los procesos antes de medir
+        list(pool.map(check_password_hash, [pw_hash] * workers, [password] * workers))
+        start = time.perf_counter()
+        results = list(pool.map(check_password_hash, [pw_hash] * total, [password] * total))
+        elapsed = time.perf_counter() - start
+    if not all(results):
+        raise RuntimeError("La verificación de contraseña falló")
+    return total / elapsed
+
+
+def bench_cpu(iterations, total, max_workers):
+    password = "password123"
+    pw_hash = generate_password_hash(password, method=f"pbkdf2:sha256:{iterations}")
+
+    start = time.perf_counter()
+    check_password_hash(pw_hash, password)
+    single = time.perf_counter() - start
+
+    print(f"🔐 PBKDF2-SHA256 con {iterations} iteraciones: {single * 1000:.1f} ms por verificación")
+    print(f"{'workers':>8} {'logins/s':>10} {'speedup':>8}")
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        rate = bench_pool(workers, pw_hash, password, total)
+        baseline = baseline or rate
+        print(f"{workers:>8} {rate:>10.1f} {rate / baseline:>7.2f}x")
+
+
+def bench_http(url, username, password, total, concurrency):
+    import requests
+
+    def login(_):
+        start = time.perf_counter()
+        resp = requests.post(f"{url}/api/auth/login",
+                             json={"username": username, "password": password}, timeout=30)
+        return resp.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(login, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(lat for _, lat in results)
+    codes = {}
+    for code, _ in results:
+        codes[code] = codes.get(code, 0) + 1
+    print(f"🌐 {total} logins con concurrencia {concurrency} en {elapsed:.2f} s "
+          f"→ {total / elapsed:.1f} logins/s")
+    print(f"   p50={latencies[len(latencies) // 2] * 1000:.0f} ms "
+          f"p95={latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000:.0f} ms "
+          f"códigos={codes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=600000, help="Costo PBKDF2 (PASSWORD_HASH_ITERATIONS)")
+    parser.add_argument("--requests", type=int, default=200, help="Verificaciones/logins a medir")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--url", help="URL base del servicio para medir /api/auth/login")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.url:
+        if not args.username or not args.password:
+            sys.exit("--username y --password son obligatorios con --url")
+        bench_http(args.url, args.username, args.password, args.requests, args.concurrency)
+    else:
+        bench_cpu(args.iterations, args.requests, args.max_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Planes y latencia de /api/books/search
+Descripción: Genera con micro.build_search_query las mismas consultas que
+ejecuta el endpoint para un conjunto de búsquedas representativas, ejecuta
+EXPLAIN sobre cada una y comprueba que usen el índice esperado de
+BookCatalog (migrations/003_book_catalog_search_indexes.sql) sin filesort.
+Después mide la latencia de cada consulta. Termina con código 1 si algún
+plan no usa índice.
+
+Uso:
+    python bench_search_plans.py               # EXPLAIN + 50 ejecuciones por caso
+    python bench_search_plans.py --runs 200 --explain-only
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pymysql
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import micro  # noqa: E402  (importar micro no abre conexiones)
+
+# (descripción, parámetros de búsqueda, índices aceptables; None = sin índice esperado)
+CASES = [
+    ("Todo, por id", {}, {"PRIMARY"}),
+    ("Género + rango de años, por año", {"genre": "Fiction", "year_min": "1990", "year_max": "2010", "sort": "year"},
+     {"genre_year"}),
+    ("Género, por precio desc", {"genre": "Fiction", "sort": "-price"}, {"genre_price"}),
+    ("Formato + en stock, por año desc", {"format": "Hardcover", "in_stock": "true", "sort": "-year"},
+     {"format_year"}),
+    ("Formato + rango de precio, por precio", {"format": "Paperback", "price_min": "10", "price_max": "30",
+                                               "sort": "price"}, {"format_price"}),
+    ("Rango de años", {"year_min": "2000", "year_max": "2005", "sort": "year"}, {"publication_year"}),
+    ("Más baratos", {"sort": "price", "limit": "10"}, {"price"}),
+    ("Prefijo de título", {"title": "The", "sort": "title"}, {"title"}),
+    # LIKE '%...%' no puede usar índice: se informa, pero no falla
+    ("Autor (subcadena)", {"author": "King"}, None),
+]
+
+
+def explain(cursor, sql, params):
+    cursor.execute("EXPLAIN " + sql, params)
+    return cursor.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=50, help="Ejecuciones por caso para medir latencia")
+    parser.add_argument("--explain-only", action="store_true")
+    args = parser.parse_args()
+
+    connection = pymysql.connect(**{**micro.DB_CONFIG, "cursorclass": pymysql.cursors.DictCursor})
+    failures = 0
+    print(f"{'caso':<40} {'índice':<18} {'filas':>7} {'p50 ms':>8} {'p99 ms':>8}  extra")
+    try:
+        with connection.cursor() as cursor:
+            for name, search, expected in CASES:
+                sql, params, _, _ = micro.build_search_query(search)
+                plan = explain(cursor, sql, params)[0]
+                key = plan.get("key") or "-"
+                extra = plan.get("Extra") or ""
+                ok = expected is None or (key in expected and "filesort" not in extra)
+                failures += 0 if ok else 1
+
+                p50 = p99 = float("nan")
+                if not args.explain_only:
+                    latencies = []
+                    for _ in range(args.runs):
+                        start = time.perf_counter()
+                        cursor.execute(sql, params)
+                        cursor.fetchall()
+                        latencies.append(time.perf_counter() - start)
+                    latencies.sort()
+                    p50 = latencies[len(latencies) // 2] * 1000
+                    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000
+
+                mark = "✅" if ok else "❌"
+                print(f"{mark} {name:<38} {key:<18} {plan.get('rows') or 0:>7} {p50:>8.2f} {p99:>8.2f}  {extra}")
+    finally:
+        connection.close()
+
+    if failures:
+        sys.exit(f"❌ {failures} consulta(s) no usan el índice esperado")
+    print("✅ Todos los planes usan los índices esperados")
+
+
+if __name__ == "__main__":
+    main()
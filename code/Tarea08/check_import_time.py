@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Presupuesto de tiempo de importación de micro.py
+Descripción: Ejecuta `python -X importtime -c "import micro"` en un proceso
+nuevo y falla (código 1) si la importación supera el presupuesto o si se
+cargan módulos pesados que deben importarse de forma diferida.
+
+Uso:
+    python check_import_time.py                 # presupuesto por defecto
+    python check_import_time.py --budget-ms 400 --runs 5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Módulos que sólo deben cargarse al usarse (GCS, Swagger)
+LAZY_MODULES = ("google.cloud.storage", "flasgger")
+
+
+def measure():
+    """Devuelve (ms acumulados de micro, módulos importados)"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import micro"],
+                          cwd=BASE_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(f"❌ No se pudo importar micro:\n{proc.stderr}")
+
+    total_us = None
+    modules = set()
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        modules.add(name)
+        if name == "micro":
+            total_us = int(cumulative)
+    if total_us is None:
+        sys.exit("❌ No se encontró 'micro' en la salida de -X importtime")
+    return total_us / 1000, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "600")))
+    parser.add_argument("--runs", type=int, default=3, help="Se toma el mejor de N procesos")
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    best_ms = min(ms for ms, _ in results)
+    modules = results[0][1]
+
+    failed = False
+    eager = [m for m in LAZY_MODULES if m in modules]
+    if eager:
+        print(f"❌ Módulos que deberían ser diferidos se importaron: {', '.join(eager)}")
+        failed = True
+    if best_ms > args.budget_ms:
+        print(f"❌ import micro: {best_ms:.0f} ms (presupuesto {args.budget_ms:.0f} ms)")
+        failed = True
+    else:
+        print(f"✅ import micro: {best_ms:.0f} ms (presupuesto {args.budget_ms:.0f} ms)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Single-flight entre workers
+Descripción: Lanza dos procesos que comparten el Redis configurado para
+micro.py (SINGLEFLIGHT_REDIS=1) y piden la misma clave a la vez. El líder
+calcula despacio; el otro proceso lee el lock mientras el líder trabaja y
+no vuelve a consultar Redis hasta que el líder ha terminado y liberado el
+lock. Comprueba que el segundo proceso reutiliza los bytes del líder en
+lugar de recalcular. Termina con código 1 si no es así.
+
+Uso:
+    python check_single_flight.py
+    python check_single_flight.py --leader-seconds 1.0
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import uuid
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+os.environ["SINGLEFLIGHT_REDIS"] = "1"
+
+import micro  # noqa: E402  (importar micro no abre conexiones)
+
+
+def leader(key, seconds, started, finished, results):
+    def compute():
+        started.set()
+        micro.time.sleep(seconds)
+        return b"leader"
+
+    try:
+        results.put(("leader", micro.single_flight.do(key, compute)))
+    finally:
+        finished.set()
+
+
+def waiter(key, started, finished, results):
+    real_sleep = micro.time.sleep
+
+    def sleep_until_leader_done(delay):
+        # La primera espera del bucle de sondeo dura hasta que el líder termina
+        finished.wait(30)
+        real_sleep(delay)
+
+    started.wait(30)
+    micro.time.sleep = sleep_until_leader_done
+    results.put(("waiter", micro.single_flight.do(key, lambda: b"waiter")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leader-seconds", type=float, default=0.5, help="Duración del cálculo del líder")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    key = f"check_single_flight:{uuid.uuid4().hex}"
+    started, finished, results = ctx.Event(), ctx.Event(), ctx.Queue()
+    workers = [
+        ctx.Process(target=leader, args=(key, args.leader_seconds, started, finished, results)),
+        ctx.Process(target=waiter, args=(key, started, finished, results)),
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+
+    got = {}
+    while not results.empty():
+        name, body = results.get()
+        got[name] = body
+    if got.get("leader") != b"leader":
+        sys.exit(f"❌ El líder no terminó correctamente: {got}")
+    if got.get("waiter") != b"leader":
+        sys.exit(f"❌ El segundo worker recalculó en vez de reutilizar el resultado del líder: {got}")
+    print("✅ El segundo worker reutilizó el resultado publicado por el líder")
+
+
+if __name__ == "__main__":
+    main()
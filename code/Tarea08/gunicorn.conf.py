@@ -0,0 +1,60 @@
+"""
+Configuración de gunicorn para producción (prefork)
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+- Un proceso por núcleo (x2 + 1) con varios hilos cada uno.
+- preload_app: la app se importa una vez en el master y los workers la
+  comparten con copy-on-write; post_fork recrea el pool MySQL y el cliente
+  Redis en cada worker para no compartir sockets. Sin preload (gevent) cada
+  worker los crea al cargar wsgi.py, ya parcheado.
+- Cada worker tiene su propio pool de hashing de contraseñas: por defecto se
+  reparten los núcleos entre los workers (PASSWORD_HASH_WORKERS).
+- max_requests + jitter reciclan workers de forma escalonada para contener
+  el crecimiento de memoria; graceful_timeout deja terminar las peticiones.
+"""
+
+import multiprocessing
+import os
+import sys
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5003')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))  # solo gevent
+
+# Un pool de hashing por worker: repartir los núcleos en lugar de lanzar
+# cpu_count procesos en cada uno (~núcleos² en total)
+os.environ.setdefault('PASSWORD_HASH_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+# gevent debe parchear la librería estándar antes de importar la app,
+# por eso con workers gevent la app se carga en cada worker
+preload_app = worker_class != 'gevent'
+
+# Reciclado de workers
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '5000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '500'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG')  # None = desactivado
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Sin preload_app la app aún no se ha importado, y gevent todavía no ha
+    # parcheado la librería estándar: wsgi.py (create_app) inicializa el worker
+    if not server.cfg.preload_app or 'micro' not in sys.modules:
+        return
+    import micro
+    micro.init_worker()
+    server.log.info("Worker %s: MySQL pool and Redis client re-created", worker.pid)
+
+
+def worker_exit(server, worker):
+    if 'micro' not in sys.modules:
+        return
+    import micro
+    micro.shutdown_worker()
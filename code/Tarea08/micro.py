@@ -2,22 +2,40 @@ import os
 import logging
 import json
 import hashlib
+import base64
+import calendar
+import threading
+import time
+import uuid
+import itertools
+import copy
+import queue
+import random
+import atexit
+import logging.handlers
+import sys
+import bisect
+import math
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import deque
 from datetime import datetime, timedelta
 from functools import wraps
+from urllib.parse import urlencode
 
-from flask import Flask, request, jsonify, g, Response
+from flask import (Flask, request, jsonify, g, Response, has_request_context, stream_with_context,
+                   copy_current_request_context)
 from flask_cors import CORS
 import pymysql
+from pymysql.constants import SERVER_STATUS
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.exceptions import RequestEntityTooLarge
 import jwt  # PyJWT
 import redis
 
-# Cloud storage / uploads
-from google.cloud import storage
+# Cloud storage / uploads (google.cloud.storage is imported on first use)
 from werkzeug.utils import secure_filename
-from dotenv import load_dotenv
-from flasgger import Swagger, swag_from
 
 # ---------- CONFIG ----------
 app = Flask(__name__)
@@ -35,14 +53,36 @@ DB_CONFIG = {
 # Load environment variables from .env alongside this file
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ENV_PATH = os.path.join(BASE_DIR, '.env')
-load_dotenv(ENV_PATH)
+if os.path.exists(ENV_PATH):
+    from dotenv import load_dotenv
+    load_dotenv(ENV_PATH)
 
 # CORS configuration (allow all origins)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# Swagger documentation
-swagger = Swagger(app)
-swagger_doc = swag_from
+# Swagger documentation: specs are recorded at import and flasgger is only
+# imported when create_app() builds the docs (SWAGGER_ENABLED=0 skips it)
+SWAGGER_ENABLED = os.getenv('SWAGGER_ENABLED', '1') == '1'
+swagger = None
+swagger_specs = {}
+
+def swagger_doc(specs):
+    """Record Swagger specs for a view; applied later by init_swagger()"""
+    def decorator(f):
+        swagger_specs[f.__name__] = specs
+        return f
+    return decorator
+
+def init_swagger():
+    global swagger
+    if swagger is not None or not SWAGGER_ENABLED:
+        return
+    from flasgger import Swagger, swag_from
+    for endpoint, specs in swagger_specs.items():
+        view = app.view_functions.get(endpoint)
+        if view is not None:
+            app.view_functions[endpoint] = swag_from(specs)(view)
+    swagger = Swagger(app)
 
 # Image / GCS configuration
 # Upload validation
@@ -72,9 +112,16 @@ REDIS_PORT = 6379
 REDIS_DB = 0
 REDIS_PASSWORD = None
 
+logger = logging.getLogger('auth_service')
+
 # ---------- REDIS CONNECTION ----------
-try:
-    redis_client = redis.Redis(
+# The client is built on first use; redis-py connects lazily as well, so
+# importing this module never blocks on the network.
+REDIS_AVAILABILITY_TTL = 1.0  # seconds a ping result is reused by redis_available()
+
+def create_redis_client():
+    """Create a Redis client (no connection is opened yet)"""
+    return InstrumentedRedis(
         host=REDIS_HOST,
         port=REDIS_PORT,
         db=REDIS_DB,
@@ -83,17 +130,437 @@ try:
         socket_connect_timeout=5,
         socket_timeout=5
     )
-    # Test connection
-    redis_client.ping()
-    logger = logging.getLogger('auth_service')
-    logger.info("Redis connection established successfully")
-except Exception as e:
-    logger = logging.getLogger('auth_service')
-    logger.error(f"Failed to connect to Redis: {e}")
-    redis_client = None
+
+redis_client = None
+redis_client_lock = threading.Lock()
+redis_health = {'ok': False, 'checked_at': float('-inf')}
 
 # ---------- LOGGING ----------
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+# Records are filtered and formatted lazily: the request thread only applies
+# per-route sampling and the per-request budget, then hands the record to a
+# bounded queue; a QueueListener thread per worker formats and writes it.
+# Warnings and errors are never sampled out or budgeted.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json | text
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+# Per-route overrides keyed by url rule: "/api/books=0.1,/api/health=0"
+LOG_SAMPLE_RATES = {
+    rule.strip(): float(rate)
+    for rule, _, rate in (item.rpartition('=') for item in os.getenv('LOG_SAMPLE_RATES', '').split(',') if '=' in item)
+}
+LOG_BUDGET_PER_REQUEST = int(os.getenv('LOG_BUDGET_PER_REQUEST', '20'))
+LOG_BODY_MAX_BYTES = int(os.getenv('LOG_BODY_MAX_BYTES', '1024'))
+LOG_REDACTED_FIELDS = {'password', 'refresh_token', 'access_token', 'token'}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id:
+            entry['trace_id'] = trace_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RequestLogFilter(logging.Filter):
+    """Sampling, per-request budget and trace id, applied in the caller"""
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        trace = g.get('trace')
+        if trace is not None:
+            record.trace_id = trace.trace_id
+        if record.levelno >= logging.WARNING:
+            return True
+        if not g.get('log_sampled', True):
+            return False
+        count = g.get('log_count', 0)
+        if count >= LOG_BUDGET_PER_REQUEST:
+            g.log_suppressed = g.get('log_suppressed', 0) + 1
+            return False
+        g.log_count = count + 1
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render the message now (args may be mutated later) but leave the
+        # formatting to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def make_log_formatter():
+    if LOG_FORMAT == 'json':
+        return JsonFormatter()
+    return logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+
+log_state = {'listener': None, 'handler': None, 'pid': None}
+
+def _install_root_handler(handler):
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+def start_log_listener():
+    """Route this process' logging through a queue and a writer thread.
+
+    Called from init_worker so each forked worker gets its own listener
+    (threads do not survive fork).
+    """
+    if log_state['pid'] == os.getpid():
+        return
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(make_log_formatter())
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(RequestLogFilter())
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    _install_root_handler(queue_handler)
+    log_state.update({'listener': listener, 'handler': queue_handler, 'pid': os.getpid()})
+
+def stop_log_listener():
+    """Flush queued records and stop the writer thread"""
+    listener = log_state['listener']
+    if listener is None or log_state['pid'] != os.getpid():
+        return
+    log_state['listener'] = None
+    log_state['pid'] = None
+    listener.stop()
+
+atexit.register(stop_log_listener)
+
+# Until a worker starts its listener (e.g. at import time) log synchronously
+_import_handler = logging.StreamHandler()
+_import_handler.setFormatter(make_log_formatter())
+_import_handler.addFilter(RequestLogFilter())
+_install_root_handler(_import_handler)
+
+# ---------- METRICS ----------
+# Latency histograms in Prometheus text format, served at /metrics.
+# Each thread records into its own shard, so the hot path takes no lock;
+# shards are merged when /metrics is scraped. Under gevent every greenlet
+# shares one OS thread, so a single shard is used.
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS = {
+    # name: (type, help, label names)
+    'http_request_duration_seconds': ('histogram', 'Request latency per route', ('route', 'method')),
+    'http_requests_total': ('counter', 'Requests per route and status', ('route', 'method', 'status')),
+    'db_query_duration_seconds': ('histogram', 'SQL execute latency per statement class', ('statement',)),
+    'redis_command_duration_seconds': ('histogram', 'Redis command latency', ('command',)),
+    'gcs_operation_duration_seconds': ('histogram', 'Cloud Storage operation latency', ('operation',)),
+    'serialization_duration_seconds': ('histogram', 'Response serialization time', ('format',)),
+    'singleflight_coalesced_total': ('counter', 'Reads answered with another request\'s result', ('scope',)),
+}
+
+def gevent_patched():
+    """True when gevent has monkey-patched threading (async serving mode)"""
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    return bool(gevent_monkey and gevent_monkey.is_module_patched('threading'))
+
+class MetricsRegistry:
+    """Lock-free (per-thread) histogram and counter aggregation."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = []  # (thread, shard)
+        self._retired = {}  # folded shards of threads that exited
+        self._lock = threading.Lock()
+        self._shared = None
+
+    def _shard(self):
+        if self._shared is not None:
+            return self._shared
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            if gevent_patched():
+                self._shared = shard
+            else:
+                self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > 64:
+                    self._fold_dead_shards()
+        return shard
+
+    def observe(self, name, labels, seconds):
+        shard = self._shard()
+        entry = shard.get((name, labels))
+        if entry is None:
+            entry = shard[(name, labels)] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, seconds)] += 1
+        entry[1] += seconds
+
+    def inc(self, name, labels, amount=1):
+        shard = self._shard()
+        shard[(name, labels)] = shard.get((name, labels), 0) + amount
+
+    @contextmanager
+    def timer(self, name, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, labels, time.perf_counter() - start)
+
+    def _merge(self, target, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                merged = target.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+                for i, count in enumerate(value[0]):
+                    merged[0][i] += count
+                merged[1] += value[1]
+            else:
+                target[key] = target.get(key, 0) + value
+
+    def _fold_dead_shards(self):
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive() or shard is self._shared:
+                alive.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = alive
+
+    def snapshot(self):
+        with self._lock:
+            self._fold_dead_shards()
+            merged = {}
+            self._merge(merged, self._retired)
+            for _, shard in self._shards:
+                self._merge(merged, shard)
+        return merged
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of every series plus `gauges`"""
+        merged = self.snapshot()
+        lines = []
+        for name, (kind, help_text, label_names) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(merged.items(), key=lambda kv: kv[0]):
+                if metric != name:
+                    continue
+                label_str = ",".join(f'{k}="{_escape_label(v)}"' for k, v in zip(label_names, labels))
+                if kind == 'counter':
+                    lines.append(f"{name}{{{label_str}}} {value}")
+                    continue
+                sep = "," if label_str else ""
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), value[0]):
+                    cumulative += count
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{{{label_str}{sep}le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{label_str}}} {value[1]:.6f}")
+                lines.append(f"{name}_count{{{label_str}}} {cumulative}")
+        for name, help_text, value in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = MetricsRegistry(METRICS_BUCKETS)
+
+# ---------- TRACING ----------
+# Every request gets a trace id (X-Trace-Id, propagated if the caller sends
+# one) and a span tree: DB executes, Redis commands and storage calls open
+# spans automatically, handlers can add their own with trace_span(). Requests
+# slower than SLOW_REQUEST_MS keep their full tree in a per-worker ring buffer
+# exposed at /api/admin/slow-requests.
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', '1') == '1'
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '1000'))
+SLOW_REQUEST_BUFFER = int(os.getenv('SLOW_REQUEST_BUFFER', '100'))
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '500'))
+
+class Span:
+    __slots__ = ('name', 'attrs', 'start', 'duration', 'children', 'error')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.duration = None
+        self.children = []
+        self.error = None
+
+    def to_dict(self, origin):
+        data = {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.error:
+            data['error'] = self.error
+        if self.children:
+            data['children'] = [child.to_dict(origin) for child in self.children]
+        return data
+
+class RequestTrace:
+    """Span tree of one request; lives in flask.g"""
+
+    def __init__(self, trace_id, name):
+        self.trace_id = trace_id
+        self.root = Span(name, {})
+        self.stack = [self.root]
+        self.span_count = 0
+        self.dropped = 0
+
+    def open(self, name, attrs):
+        if self.span_count >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return None
+        span = Span(name, attrs)
+        self.stack[-1].children.append(span)
+        self.stack.append(span)
+        self.span_count += 1
+        return span
+
+    def close(self, span, error=None):
+        span.duration = time.perf_counter() - span.start
+        if error is not None:
+            span.error = type(error).__name__
+        if self.stack and self.stack[-1] is span:
+            self.stack.pop()
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'duration_ms': round(self.root.duration * 1000, 3),
+            'spans': self.root.to_dict(self.root.start),
+            'dropped_spans': self.dropped,
+        }
+
+def current_trace():
+    if not has_request_context():
+        return None
+    return g.get('trace')
+
+@contextmanager
+def trace_span(name, **attrs):
+    trace = current_trace()
+    span = trace.open(name, attrs) if trace is not None else None
+    if span is None:
+        yield
+        return
+    try:
+        yield
+    except BaseException as exc:
+        trace.close(span, exc)
+        raise
+    trace.close(span)
+
+@contextmanager
+def timed(metric, label, span=None, **attrs):
+    """Observe `metric{label}` and, inside a request, record a span"""
+    start = time.perf_counter()
+    try:
+        if span is None:
+            yield
+        else:
+            with trace_span(span, **attrs):
+                yield
+    finally:
+        metrics.observe(metric, (label,), time.perf_counter() - start)
+
+slow_requests = deque(maxlen=SLOW_REQUEST_BUFFER)
+
+class InstrumentedCursor(pymysql.cursors.DictCursor):
+    """DictCursor that times (and traces) every execute by statement class"""
+
+    def execute(self, query, args=None):
+        statement = query.lstrip().split(None, 1)[0].upper() if query.strip() else 'UNKNOWN'
+        with timed('db_query_duration_seconds', statement, 'db.execute', sql=' '.join(query.split())[:200]):
+            return super().execute(query, args)
+
+DB_CONFIG['cursorclass'] = InstrumentedCursor
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        with timed('redis_command_duration_seconds', 'PIPELINE', 'redis.pipeline',
+                   commands=len(self.command_stack)):
+            return super().execute(raise_on_error)
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client that times (and traces) every command"""
+
+    def execute_command(self, *args, **options):
+        command = str(args[0]).upper()
+        with timed('redis_command_duration_seconds', command, 'redis.' + command):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if TRACING_ENABLED:
+        trace_id = request.headers.get('X-Trace-Id', '')
+        if not (0 < len(trace_id) <= 64 and trace_id.replace('-', '').isalnum()):
+            trace_id = uuid.uuid4().hex
+        g.trace = RequestTrace(trace_id, f"{request.method} {request.path}")
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', (route, request.method), time.perf_counter() - start)
+        metrics.inc('http_requests_total', (route, request.method, str(response.status_code)))
+    trace = g.pop('trace', None)
+    if trace is not None:
+        trace.close(trace.root)
+        response.headers['X-Trace-Id'] = trace.trace_id
+        if trace.root.duration * 1000 >= SLOW_REQUEST_MS:
+            entry = trace.to_dict()
+            entry.update({
+                'method': request.method,
+                'path': request.path,
+                'route': request.url_rule.rule if request.url_rule else None,
+                'status': response.status_code,
+                'recorded_at': datetime.utcnow().isoformat() + 'Z',
+            })
+            slow_requests.append(entry)
+            logger.warning("Slow request %s %s took %.0f ms (trace %s)",
+                           request.method, request.path, entry['duration_ms'], trace.trace_id)
+    return response
 
 # ---------- IMAGE & STORAGE HELPERS ----------
 class ImageValidationError(Exception):
@@ -113,6 +580,7 @@ def get_storage_bucket():
     global storage_client
     try:
         if storage_client is None:
+            from google.cloud import storage
             storage_client = storage.Client()
         return storage_client.bucket(GCS_BUCKET)
     except Exception as exc:
@@ -169,8 +637,10 @@ def upload_images_to_gcs(isbn, files):
         try:
             blob = bucket.blob(object_name)
             file_obj.stream.seek(0)
-            blob.upload_from_file(file_obj.stream, content_type=data["mimetype"])
-            signed_url = blob.generate_signed_url(expiration=timedelta(seconds=SIGNED_URL_EXPIRATION))
+            with timed('gcs_operation_duration_seconds', 'upload', 'gcs.upload', object=object_name):
+                blob.upload_from_file(file_obj.stream, content_type=data["mimetype"])
+            with timed('gcs_operation_duration_seconds', 'sign_url', 'gcs.sign_url', object=object_name):
+                signed_url = blob.generate_signed_url(expiration=timedelta(seconds=SIGNED_URL_EXPIRATION))
             uploaded.append({
                 "filename": data["filename"],
                 "object_name": object_name,
@@ -211,7 +681,8 @@ def cleanup_gcs_objects(object_names):
             continue
         try:
             blob = bucket.blob(obj)
-            blob.delete()
+            with timed('gcs_operation_duration_seconds', 'delete', 'gcs.delete', object=obj):
+                blob.delete()
         except Exception:
             logger.warning("No se pudo eliminar el objeto %s en GCS", obj)
 
@@ -219,21 +690,14 @@ def fetch_book_images_map(book_ids):
     """Return a dict {book_id: [images]} for the provided ids."""
     if not book_ids:
         return {}
-    rows = []
-    connection = pymysql.connect(**DB_CONFIG)
-    try:
-        placeholders = ",".join(["%s"] * len(book_ids))
-        sql = f"""
-            SELECT image_id, book_id, filename, object_name, size_bytes, mime_type, signed_url, position, uploaded_at
-            FROM BookImage
-            WHERE book_id IN ({placeholders})
-            ORDER BY position, image_id
-        """
-        with connection.cursor() as cursor:
-            cursor.execute(sql, tuple(book_ids))
-            rows = cursor.fetchall()
-    finally:
-        connection.close()
+    placeholders = ",".join(["%s"] * len(book_ids))
+    sql = f"""
+        SELECT image_id, book_id, filename, object_name, size_bytes, mime_type, signed_url, position, uploaded_at
+        FROM BookImage
+        WHERE book_id IN ({placeholders})
+        ORDER BY position, image_id
+    """
+    rows = query_replica(sql, tuple(book_ids))
     images_map = {}
     for row in rows:
         images_map.setdefault(row['book_id'], []).append(row)
@@ -241,7 +705,8 @@ def fetch_book_images_map(book_ids):
 
 def attach_images_to_books(books):
     """Attach image metadata to book rows prior to building XML."""
-    book_ids = [b['book_id'] for b in books if 'book_id' in b]
+    # Catalog rows carry image_count: books without images need no lookup
+    book_ids = [b['book_id'] for b in books if 'book_id' in b and b.get('image_count', 1)]
     images_map = fetch_book_images_map(book_ids)
     for book in books:
         book['images'] = images_map.get(book.get('book_id'), [])
@@ -265,15 +730,31 @@ def parse_book_request():
     except ET.ParseError as exc:
         raise ValueError(f"XML inválido: {exc}") from exc
 
-# Log every incoming request (method, path, ip, body if json)
+def _redact(value):
+    if isinstance(value, dict):
+        return {k: '***' if k in LOG_REDACTED_FIELDS else _redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+# Log incoming requests (sampled per route; small JSON bodies only, redacted)
 @app.before_request
 def log_request_info():
-    try:
+    rule = request.url_rule.rule if request.url_rule else None
+    g.log_sampled = random.random() < LOG_SAMPLE_RATES.get(rule, LOG_SAMPLE_RATE)
+    if not g.log_sampled or not logger.isEnabledFor(logging.INFO):
+        return
+    fields = {
+        'method': request.method,
+        'path': request.path,
+        'ip': request.remote_addr,
+        'body_bytes': request.content_length,
+    }
+    if request.is_json and (request.content_length or 0) <= LOG_BODY_MAX_BYTES:
         body = request.get_json(silent=True)
-    except Exception:
-        body = None
-    logger.info("Incoming request: %s %s from %s body=%s",
-                request.method, request.path, request.remote_addr, body)
+        if body is not None:
+            fields['body'] = json.dumps(_redact(body), ensure_ascii=False)[:LOG_BODY_MAX_BYTES]
+    logger.info("Incoming request", extra={'fields': fields})
 
 @app.errorhandler(RequestEntityTooLarge)
 def handle_large_file_error(_):
@@ -283,68 +764,328 @@ def handle_large_file_error(_):
 
 # ---------- REDIS HELPERS ----------
 def get_redis():
-    """Get Redis client with error handling"""
-    if not redis_client:
-        raise Exception("Redis not available")
+    """Get the Redis client, creating it on first use"""
+    global redis_client
+    if redis_client is None:
+        with redis_client_lock:
+            if redis_client is None:
+                redis_client = create_redis_client()
     return redis_client
 
 def redis_available():
-    """Check if Redis is available"""
+    """Check if Redis is available (ping result cached for a second)"""
+    now = time.monotonic()
+    if now - redis_health['checked_at'] < REDIS_AVAILABILITY_TTL:
+        return redis_health['ok']
     try:
         get_redis().ping()
-        return True
-    except:
-        return False
+        ok = True
+    except Exception as e:
+        if redis_health['ok']:
+            logger.error("Redis not available: %s", e)
+        ok = False
+    redis_health['ok'] = ok
+    redis_health['checked_at'] = now
+    return ok
+
+def scan_batches(r, pattern, count):
+    """Yield lists of keys matching `pattern` using a SCAN cursor."""
+    cursor = 0
+    while True:
+        cursor, keys = r.scan(cursor=cursor, match=pattern, count=count)
+        if keys:
+            yield keys
+        if cursor == 0:
+            break
+
+# Compact token key layout: the first 128 bits of the SHA-256 digest in
+# base64url (22 chars instead of 64 hex chars), short key prefixes and
+# integer epoch timestamps. Allowlist entries are small hashes, which Redis
+# stores with the listpack encoding.
+ALLOWLIST_PREFIX = 'al'
+DENYLIST_PREFIX = 'dl'
+USER_TOKENS_PREFIX = 'ut'
+TOKEN_TYPE_CODES = {'access': 'a', 'refresh': 'r'}
+# Keys written with the previous layout (allowlist:/denylist:<sha256 hex>)
+# are still honoured until they expire
+LEGACY_TOKEN_KEYS = os.getenv('LEGACY_TOKEN_KEYS', '1') == '1'
 
 def hash_token(token):
-    """Create a hash of the token for storage"""
+    """Create a compact hash of the token for storage"""
+    digest = hashlib.sha256(token.encode()).digest()
+    return base64.urlsafe_b64encode(digest[:16]).rstrip(b'=').decode()
+
+def legacy_hash_token(token):
+    """Hash used by the previous key layout (64-char hex SHA-256)"""
     return hashlib.sha256(token.encode()).hexdigest()
 
+def allowlist_key(token_hash):
+    return f"{ALLOWLIST_PREFIX}:{token_hash}"
+
+def denylist_key(token_hash):
+    return f"{DENYLIST_PREFIX}:{token_hash}"
+
+def user_tokens_key(user_id, token_type):
+    return f"{USER_TOKENS_PREFIX}:{user_id}:{TOKEN_TYPE_CODES.get(token_type, token_type)}"
+
+def to_epoch(dt):
+    """Naive UTC datetime → integer epoch seconds"""
+    return calendar.timegm(dt.utctimetuple())
+
+# ---------- BACKGROUND TASKS ----------
+class PeriodicTask:
+    """Daemon thread that runs `func` every `interval` seconds.
+
+    The thread is started lazily and restarted if the process was forked,
+    so module-level instances are safe to share with prefork servers.
+    """
+
+    def __init__(self, name, interval, func, run_immediately=False):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_immediately = run_immediately
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        if self.run_immediately:
+            self._run_once()
+        while not self._stop.wait(self.interval):
+            self._run_once()
+
+    def _run_once(self):
+        try:
+            self.func()
+        except Exception:
+            logger.exception("Background task %s failed", self.name)
+
+# ---------- REDIS PUB/SUB ----------
+class RedisEventListener:
+    """One pub/sub connection per worker that dispatches messages by channel.
+
+    Handlers register a message callback and an optional resync callback.
+    Resyncs run right after every (re)subscribe, so state rebuilt from Redis
+    never misses an event published while the connection was down.
+    """
+
+    def __init__(self, reconnect_delay=1.0):
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        self._handlers = {}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def register(self, channel, on_message, on_resync=None, on_disconnect=None):
+        self._handlers[channel] = (on_message, on_resync, on_disconnect)
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self.connected = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='redis-events', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(*self._handlers.keys())
+                for _, on_resync, _ in list(self._handlers.values()):
+                    if on_resync:
+                        on_resync()
+                self.connected = True
+                logger.info("Subscribed to Redis channels: %s", ", ".join(self._handlers))
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if not message or message.get('type') != 'message':
+                        continue
+                    handler = self._handlers.get(message['channel'])
+                    if handler:
+                        try:
+                            handler[0](message['data'])
+                        except Exception:
+                            logger.exception("Error handling message on %s", message['channel'])
+            except Exception as e:
+                if self.connected:
+                    logger.warning("Redis pub/sub connection lost: %s", e)
+                self.connected = False
+                for _, _, on_disconnect in list(self._handlers.values()):
+                    if on_disconnect:
+                        on_disconnect()
+                time.sleep(self.reconnect_delay)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+redis_events = RedisEventListener()
+
+def publish_event(channel, payload):
+    """Publish a JSON payload; failures are logged and otherwise ignored."""
+    try:
+        get_redis().publish(channel, json.dumps(payload))
+    except Exception as e:
+        logger.error("Failed to publish on %s: %s", channel, e)
+
+# ---------- DENYLIST REPLICA ----------
+DENYLIST_CHANNEL = 'denylist:events'
+DENYLIST_DEFAULT_TTL = 86400  # used when the token expiry is unknown
+
+class DenylistReplica:
+    """In-process copy of the Redis denylist kept current through pub/sub.
+
+    Entries map a token hash to the epoch at which the token expires; past
+    that point the token is rejected by the JWT check anyway, so the entry
+    is dropped. While the replica is not in sync (startup, lost connection)
+    `contains` returns None and callers fall back to Redis.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._ready = False
+        self._lock = threading.Lock()
+        self._prune_task = PeriodicTask('denylist-prune', 60, self.prune)
+
+    def ensure_started(self):
+        redis_events.ensure_started()
+        self._prune_task.ensure_started()
+
+    def contains(self, token_hash):
+        if not self._ready:
+            return None
+        expires_at = self._entries.get(token_hash)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            self._entries.pop(token_hash, None)
+            return False
+        return True
+
+    def add(self, token_hash, expires_at):
+        self._entries[token_hash] = expires_at
+
+    def on_message(self, data):
+        event = json.loads(data)
+        for token_hash in event['hashes']:
+            self.add(token_hash, event['exp'])
+
+    def resync(self):
+        """Rebuild the replica from every denylist key in Redis."""
+        r = get_redis()
+        entries = {}
+        now = time.time()
+        patterns = [denylist_key('*')] + (["denylist:*"] if LEGACY_TOKEN_KEYS else [])
+        for pattern in patterns:
+            for keys in scan_batches(r, pattern, 500):
+                pipe = r.pipeline(transaction=False)
+                for key in keys:
+                    pipe.ttl(key)
+                for key, ttl in zip(keys, pipe.execute()):
+                    if ttl and ttl > 0:
+                        entries[key.split(':', 1)[1]] = now + ttl
+        with self._lock:
+            # Keep anything published while the scan was running
+            entries.update(self._entries)
+            self._entries = entries
+            self._ready = True
+        logger.info("Denylist replica resynced: %d entries", len(entries))
+
+    def mark_stale(self):
+        self._ready = False
+
+    def prune(self):
+        now = time.time()
+        for token_hash, expires_at in list(self._entries.items()):
+            if expires_at <= now:
+                self._entries.pop(token_hash, None)
+
+denylist_replica = DenylistReplica()
+redis_events.register(DENYLIST_CHANNEL, denylist_replica.on_message,
+                      denylist_replica.resync, denylist_replica.mark_stale)
+
+def token_expiry(token):
+    """Return the `exp` claim of a token as epoch seconds, or None."""
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False, "verify_exp": False})
+        return int(claims['exp'])
+    except Exception:
+        return None
+
 # ---------- REDIS TOKEN MANAGEMENT ----------
 def add_token_to_allowlist(token, user_id, token_type, expires_at):
     """Add token to Redis allowlist"""
     try:
         r = get_redis()
         token_hash = hash_token(token)
-        key = f"allowlist:{token_hash}"
-        
-        token_data = {
-            'user_id': user_id,
-            'type': token_type,
-            'created_at': datetime.utcnow().isoformat(),
-            'expires_at': expires_at.isoformat()
-        }
-        
-        # Set with expiration
-        ttl = int((expires_at - datetime.utcnow()).total_seconds())
-        r.setex(key, ttl, json.dumps(token_data))
-        
+        now = int(time.time())
+        exp = to_epoch(expires_at)
+        ttl = max(1, exp - now)
+
+        # u=user_id, t=type, c=created_at, e=expires_at (epoch seconds)
+        pipe = r.pipeline(transaction=False)
+        key = allowlist_key(token_hash)
+        pipe.hset(key, mapping={
+            'u': user_id,
+            't': TOKEN_TYPE_CODES.get(token_type, token_type),
+            'c': now,
+            'e': exp
+        })
+        pipe.expire(key, ttl)
+
         # Also add to user's token set for easy cleanup
-        user_tokens_key = f"user_tokens:{user_id}:{token_type}"
-        r.sadd(user_tokens_key, token_hash)
-        r.expire(user_tokens_key, ttl)
-        
+        tokens_key = user_tokens_key(user_id, token_type)
+        pipe.sadd(tokens_key, token_hash)
+        pipe.expire(tokens_key, ttl)
+        pipe.execute()
+
         logger.info("Token added to allowlist: user_id=%s type=%s", user_id, token_type)
         return True
     except Exception as e:
         logger.error("Failed to add token to allowlist: %s", e)
         return False
 
-def add_token_to_denylist(token, user_id=None):
-    """Add token to Redis denylist"""
+def add_token_to_denylist(token, user_id=None, expires_at=None):
+    """Add token to Redis denylist and broadcast it to every worker"""
     try:
         r = get_redis()
         token_hash = hash_token(token)
-        key = f"denylist:{token_hash}"
-        
-        denylist_data = {
-            'user_id': user_id,
-            'revoked_at': datetime.utcnow().isoformat()
-        }
-        
-        # Set with long expiration (24 hours)
-        r.setex(key, 86400, json.dumps(denylist_data))
-        
+
+        # Keep the entry only while the token itself is still valid
+        if expires_at is None:
+            expires_at = token_expiry(token)
+        now = int(time.time())
+        ttl = max(1, expires_at - now) if expires_at else DENYLIST_DEFAULT_TTL
+        # Value is "<user_id>:<revoked_at epoch>"
+        r.setex(denylist_key(token_hash), ttl, f"{user_id or ''}:{now}")
+
+        denylist_replica.add(token_hash, now + ttl)
+        publish_event(DENYLIST_CHANNEL, {'hashes': [token_hash], 'exp': now + ttl})
+
         logger.info("Token added to denylist: user_id=%s", user_id)
         return True
     except Exception as e:
@@ -352,12 +1093,17 @@ def add_token_to_denylist(token, user_id=None):
         return False
 
 def is_token_in_denylist(token):
-    """Check if token is in denylist"""
+    """Check if token is in denylist (local replica first, Redis as fallback)"""
+    token_hash = hash_token(token)
+    legacy_hash = legacy_hash_token(token) if LEGACY_TOKEN_KEYS else None
+    denylist_replica.ensure_started()
+    cached = denylist_replica.contains(token_hash)
+    if cached is not None:
+        return cached or bool(legacy_hash and denylist_replica.contains(legacy_hash))
     try:
         r = get_redis()
-        token_hash = hash_token(token)
-        key = f"denylist:{token_hash}"
-        return r.exists(key)
+        keys = [denylist_key(token_hash)] + ([f"denylist:{legacy_hash}"] if legacy_hash else [])
+        return r.exists(*keys) > 0
     except Exception as e:
         logger.error("Failed to check denylist: %s", e)
         return False
@@ -366,38 +1112,131 @@ def is_token_in_allowlist(token):
     """Check if token is in allowlist"""
     try:
         r = get_redis()
-        token_hash = hash_token(token)
-        key = f"allowlist:{token_hash}"
-        return r.exists(key)
+        keys = [allowlist_key(hash_token(token))]
+        if LEGACY_TOKEN_KEYS:
+            keys.append(f"allowlist:{legacy_hash_token(token)}")
+        return r.exists(*keys) > 0
     except Exception as e:
         logger.error("Failed to check allowlist: %s", e)
         return False
 
+# ---------- TOKEN GENERATIONS ----------
+# Every JWT carries the user's generation ("gen" claim). Revoking all tokens
+# of a user is a single INCR; tokens with an older generation are rejected.
+# Tokens issued before generations existed carry no claim and count as
+# generation 0. While the generation cannot be read (Redis down, nothing
+# cached) no token is issued: a guessed claim could escape a later revoke-all.
+TOKEN_GEN_CHANNEL = 'token_gen:events'
+TOKEN_GEN_CACHE_TTL = float(os.getenv('TOKEN_GEN_CACHE_TTL', '5'))  # seconds, used while pub/sub is down
+TOKEN_GEN_CACHE_MAX = int(os.getenv('TOKEN_GEN_CACHE_MAX', '100000'))
+
+class TokenGenerationUnavailable(Exception):
+    """Raised when a token would be issued without a known generation."""
+    pass
+
+class TokenGenerationCache:
+    """Per-worker cache of `token_gen:{user_id}` counters.
+
+    Bumps are broadcast on pub/sub, so cached values are trusted for as long
+    as the listener is connected. Without it entries expire after
+    TOKEN_GEN_CACHE_TTL seconds.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, user_id):
+        redis_events.ensure_started()
+        cached = self._entries.get(user_id)
+        now = time.monotonic()
+        if cached is not None and (redis_events.connected or now - cached[1] < TOKEN_GEN_CACHE_TTL):
+            return cached[0]
+        try:
+            generation = int(get_redis().get(f"token_gen:{user_id}") or 0)
+        except Exception as e:
+            logger.error("Failed to read token generation: %s", e)
+            return cached[0] if cached is not None else None  # unknown
+        self._set(user_id, generation)
+        return generation
+
+    def bump(self, user_id):
+        generation = get_redis().incr(f"token_gen:{user_id}")
+        self._set(user_id, generation)
+        publish_event(TOKEN_GEN_CHANNEL, {'user_id': user_id, 'gen': generation})
+        return generation
+
+    def _set(self, user_id, generation):
+        if len(self._entries) >= TOKEN_GEN_CACHE_MAX:
+            self._entries.clear()
+        self._entries[user_id] = (generation, time.monotonic())
+
+    def on_message(self, data):
+        event = json.loads(data)
+        cached = self._entries.get(event['user_id'])
+        # Never move backwards if messages arrive out of order
+        if cached is None or cached[0] < event['gen']:
+            self._set(event['user_id'], event['gen'])
+
+    def clear(self):
+        self._entries.clear()
+
+token_generations = TokenGenerationCache()
+redis_events.register(TOKEN_GEN_CHANNEL, token_generations.on_message, token_generations.clear)
+
+@app.errorhandler(TokenGenerationUnavailable)
+def handle_token_generation_unavailable(exc):
+    logger.warning("Token not issued, generation unknown: %s", exc)
+    response = jsonify({"msg": "Token service unavailable, please retry"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def token_generation_claim(user_id):
+    """The "gen" claim for a new token"""
+    generation = token_generations.get(user_id)
+    if generation is None:
+        raise TokenGenerationUnavailable(f"user_id={user_id}")
+    return {"gen": generation}
+
+def is_token_generation_revoked(decoded):
+    """True when the token was issued before the user's last revoke-all"""
+    current = token_generations.get(decoded.get('user_id'))
+    return current is not None and decoded.get('gen', 0) < current
+
 def revoke_user_tokens(user_id, token_type=None):
     """Revoke all tokens for a user"""
     try:
         r = get_redis()
-        
-        if token_type:
+
+        if not token_type:
+            # The bump rejects every older token at once; the per-type walk
+            # also denylists the allowlisted ones explicitly
+            token_generations.bump(user_id)
+            for t_type in ['access', 'refresh']:
+                if not revoke_user_tokens(user_id, t_type):
+                    return False
+        else:
             # Revoke specific token type
-            user_tokens_key = f"user_tokens:{user_id}:{token_type}"
-            token_hashes = r.smembers(user_tokens_key)
-            
+            tokens_key = user_tokens_key(user_id, token_type)
+            token_hashes = list(r.smembers(tokens_key))
+            now = int(time.time())
+
+            pipe = r.pipeline(transaction=False)
             for token_hash in token_hashes:
-                # Move from allowlist to denylist
-                allowlist_key = f"allowlist:{token_hash}"
-                token_data = r.get(allowlist_key)
-                if token_data:
-                    r.delete(allowlist_key)
-                    denylist_key = f"denylist:{token_hash}"
-                    r.setex(denylist_key, 86400, token_data)
-            
-            r.delete(user_tokens_key)
-        else:
-            # Revoke all token types
-            for t_type in ['access', 'refresh']:
-                revoke_user_tokens(user_id, t_type)
-        
+                pipe.ttl(allowlist_key(token_hash))
+            ttls = pipe.execute() if token_hashes else []
+
+            # Move from allowlist to denylist, keeping the token's remaining lifetime
+            pipe = r.pipeline(transaction=False)
+            for token_hash, ttl in zip(token_hashes, ttls):
+                if ttl is None or ttl <= 0:
+                    continue
+                pipe.unlink(allowlist_key(token_hash))
+                pipe.setex(denylist_key(token_hash), ttl, f"{user_id}:{now}")
+                pipe.publish(DENYLIST_CHANNEL, json.dumps({'hashes': [token_hash], 'exp': now + ttl}))
+                denylist_replica.add(token_hash, now + ttl)
+            pipe.unlink(tokens_key)
+            pipe.execute()
+
         logger.info("All tokens revoked for user_id=%s", user_id)
         return True
     except Exception as e:
@@ -405,25 +1244,162 @@ def revoke_user_tokens(user_id, token_type=None):
         return False
 
 # ---------- RATE LIMITING ----------
+# 'redis'  → every check is a round trip to Redis (exact global limits)
+# 'hybrid' → each worker spends a local token bucket and reconciles with Redis
+#            in batches; global limits are enforced approximately
+RATE_LIMIT_MODE = os.getenv('RATE_LIMIT_MODE', 'redis').lower()
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv('RATE_LIMIT_SYNC_INTERVAL', '1.0'))  # seconds
+# Fraction of a key's limit a worker may grant locally between syncs.
+# Worst-case overshoot of a global limit is workers * share * max_requests.
+RATE_LIMIT_LOCAL_SHARE = float(os.getenv('RATE_LIMIT_LOCAL_SHARE', '0.05'))
+RATE_LIMIT_CHANNEL = 'rate_limit:events'  # resets are broadcast to every worker
+
+class _LocalBucket:
+    __slots__ = ('max_requests', 'window_seconds', 'tokens', 'pending', 'window_ends', 'blocked_until')
+
+    def __init__(self, max_requests, window_seconds):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.tokens = 0
+        self.pending = 0
+        self.window_ends = 0.0
+        self.blocked_until = 0.0
+
+class HybridRateLimiter:
+    """Per-worker token buckets reconciled with Redis fixed-window counters.
+
+    Requests consume local tokens without touching the network. Consumed
+    counts are pushed to Redis with INCRBY in one pipeline per sync, and the
+    global count returned by Redis refills each bucket with at most
+    `local_share * max_requests` tokens. A bucket with no tokens left syncs
+    inline once before rejecting, so cold keys cost a single round trip.
+    """
+
+    def __init__(self, sync_interval, local_share):
+        self.local_share = local_share
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._sync_task = PeriodicTask('rate-limit-sync', sync_interval, self.sync)
+
+    def _slice(self, bucket):
+        return max(1, int(bucket.max_requests * self.local_share))
+
+    def allow(self, key, max_requests, window_seconds):
+        self._sync_task.ensure_started()
+        redis_events.ensure_started()
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _LocalBucket(max_requests, window_seconds)
+            if bucket.blocked_until > now:
+                return False
+            if bucket.tokens > 0:
+                bucket.tokens -= 1
+                bucket.pending += 1
+                return True
+        # Local allowance exhausted: reconcile this key right away
+        self._sync_keys([key])
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or bucket.blocked_until > now or bucket.tokens <= 0:
+                return False
+            bucket.tokens -= 1
+            bucket.pending += 1
+            return True
+
+    def sync(self):
+        """Flush pending counts for every known key and refill buckets."""
+        now = time.monotonic()
+        with self._lock:
+            # Forget idle keys whose window already closed
+            for key in [k for k, b in self._buckets.items()
+                        if b.pending == 0 and b.window_ends and b.window_ends <= now]:
+                del self._buckets[key]
+            keys = [k for k, b in self._buckets.items() if b.pending > 0]
+        if keys:
+            self._sync_keys(keys)
+
+    def _sync_keys(self, keys):
+        with self._lock:
+            batch = []
+            for key in keys:
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    batch.append((key, bucket, bucket.pending))
+                    bucket.pending = 0
+        if not batch:
+            return
+        try:
+            r = get_redis()
+            pipe = r.pipeline(transaction=False)
+            for key, _, pending in batch:
+                pipe.incrby(key, pending)
+                pipe.ttl(key)
+            results = pipe.execute()
+        except Exception as e:
+            logger.error("Rate limit sync failed: %s", e)
+            with self._lock:
+                for _, bucket, pending in batch:
+                    bucket.pending += pending
+                    # Keep serving from a small local allowance while Redis is down
+                    bucket.tokens = max(bucket.tokens, self._slice(bucket))
+            return
+
+        now = time.monotonic()
+        expire_pipe = r.pipeline(transaction=False)
+        needs_expire = False
+        with self._lock:
+            for i, (key, bucket, _) in enumerate(batch):
+                count, ttl = int(results[2 * i]), results[2 * i + 1]
+                if ttl is None or ttl < 0:
+                    expire_pipe.expire(key, bucket.window_seconds)
+                    needs_expire = True
+                    ttl = bucket.window_seconds
+                bucket.window_ends = now + ttl
+                remaining = bucket.max_requests - count - bucket.pending
+                if remaining <= 0:
+                    bucket.tokens = 0
+                    bucket.blocked_until = bucket.window_ends
+                else:
+                    bucket.tokens = min(remaining, self._slice(bucket))
+                    bucket.blocked_until = 0.0
+        if needs_expire:
+            try:
+                expire_pipe.execute()
+            except Exception as e:
+                logger.error("Rate limit expire failed: %s", e)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+hybrid_rate_limiter = HybridRateLimiter(RATE_LIMIT_SYNC_INTERVAL, RATE_LIMIT_LOCAL_SHARE)
+redis_events.register(RATE_LIMIT_CHANNEL, lambda data: hybrid_rate_limiter.reset())
+
+def _check_rate_limit_key(key, max_requests, window_minutes):
+    if RATE_LIMIT_MODE == 'hybrid':
+        return hybrid_rate_limiter.allow(key, max_requests, window_minutes * 60)
+
+    r = get_redis()
+    # Get current count
+    current = r.get(key)
+    if current is None:
+        # First request in window
+        r.setex(key, window_minutes * 60, 1)
+        return True
+    elif int(current) < max_requests:
+        # Increment counter
+        r.incr(key)
+        return True
+    else:
+        # Rate limit exceeded
+        return False
+
 def check_rate_limit(user_id, endpoint, max_requests=100, window_minutes=60):
     """Check rate limit for user/endpoint"""
     try:
-        r = get_redis()
-        key = f"rate_limit:{user_id}:{endpoint}"
-        
-        # Get current count
-        current = r.get(key)
-        if current is None:
-            # First request in window
-            r.setex(key, window_minutes * 60, 1)
-            return True
-        elif int(current) < max_requests:
-            # Increment counter
-            r.incr(key)
-            return True
-        else:
-            # Rate limit exceeded
-            return False
+        return _check_rate_limit_key(f"rate_limit:{user_id}:{endpoint}", max_requests, window_minutes)
     except Exception as e:
         logger.error("Rate limit check failed: %s", e)
         return True  # Allow on error
@@ -431,51 +1407,468 @@ def check_rate_limit(user_id, endpoint, max_requests=100, window_minutes=60):
 def check_rate_limit_by_ip(ip, endpoint, max_requests=100, window_minutes=60):
     """Check rate limit for IP/endpoint"""
     try:
-        r = get_redis()
-        key = f"rate_limit_ip:{ip}:{endpoint}"
-        
-        # Get current count
-        current = r.get(key)
-        if current is None:
-            # First request in window
-            r.setex(key, window_minutes * 60, 1)
-            return True
-        elif int(current) < max_requests:
-            # Increment counter
-            r.incr(key)
-            return True
-        else:
-            # Rate limit exceeded
-            return False
+        return _check_rate_limit_key(f"rate_limit_ip:{ip}:{endpoint}", max_requests, window_minutes)
     except Exception as e:
         logger.error("Rate limit check failed: %s", e)
         return True  # Allow request if Redis is down
 
+# ---------- REDIS MAINTENANCE ----------
+# Keyspace sweeps run in a background thread with SCAN cursors and UNLINK in
+# bounded batches, so Redis is never blocked by KEYS or a huge DEL.
+MAINTENANCE_BATCH_SIZE = int(os.getenv('MAINTENANCE_BATCH_SIZE', '500'))
+MAINTENANCE_BATCH_PAUSE = float(os.getenv('MAINTENANCE_BATCH_PAUSE', '0.01'))  # seconds between batches
+MAINTENANCE_MAX_JOBS = 50  # finished jobs kept in memory for status queries
+MAINTENANCE_JOB_TTL = 3600  # seconds a job's progress stays in Redis
+
+class MaintenanceJob:
+    """Progress record for a background keyspace sweep."""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = 'running'
+        self.scanned = 0
+        self.removed = 0
+        self.batches = 0
+        self.error = None
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+
+    def report(self, r):
+        """Mirror progress to Redis so any worker can answer status queries."""
+        try:
+            key = f"maintenance:job:{self.id}"
+            r.set(key, json.dumps(self.to_dict()), ex=MAINTENANCE_JOB_TTL)
+        except Exception as e:
+            logger.warning("Could not report maintenance progress: %s", e)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "scanned": self.scanned,
+            "removed": self.removed,
+            "batches": self.batches,
+            "error": self.error,
+            "started_at": self.started_at.isoformat() + "Z",
+            "finished_at": self.finished_at.isoformat() + "Z" if self.finished_at else None
+        }
+
+maintenance_jobs = {}
+maintenance_jobs_lock = threading.Lock()
+
+def _register_maintenance_job(name):
+    job = MaintenanceJob(name)
+    with maintenance_jobs_lock:
+        maintenance_jobs[job.id] = job
+        while len(maintenance_jobs) > MAINTENANCE_MAX_JOBS:
+            oldest = next(iter(maintenance_jobs))
+            if maintenance_jobs[oldest].status == 'running':
+                break
+            del maintenance_jobs[oldest]
+    return job
+
+def _run_maintenance_job(job, func):
+    r = None
+    try:
+        r = get_redis()
+        job.report(r)
+        func(job, r)
+        job.status = 'done'
+    except Exception as e:
+        logger.exception("Maintenance job %s failed", job.name)
+        job.status = 'failed'
+        job.error = str(e)
+    finally:
+        job.finished_at = datetime.utcnow()
+        if r is not None:
+            job.report(r)
+        logger.info("Maintenance job %s %s: scanned=%d removed=%d",
+                    job.name, job.status, job.scanned, job.removed)
+
+def start_maintenance_job(name, func):
+    """Run `func(job, redis)` in a daemon thread and return its job record."""
+    job = _register_maintenance_job(name)
+    threading.Thread(target=_run_maintenance_job, args=(job, func),
+                     name=f'maintenance-{name}', daemon=True).start()
+    return job
+
+def run_maintenance_job(name, func):
+    """Run `func(job, redis)` in the calling thread and return its job record."""
+    job = _register_maintenance_job(name)
+    _run_maintenance_job(job, func)
+    return job
+
+def unlink_matching(job, r, pattern):
+    """UNLINK every key matching `pattern`, one SCAN batch at a time."""
+    for keys in scan_batches(r, pattern, MAINTENANCE_BATCH_SIZE):
+        job.scanned += len(keys)
+        job.removed += r.unlink(*keys)
+        job.batches += 1
+        job.report(r)
+        time.sleep(MAINTENANCE_BATCH_PAUSE)
+
+def purge_user_token_sets(job, r):
+    """Drop hashes of expired tokens from every user token set.
+
+    A member is stale once its allowlist entry has expired; Redis removes a
+    set automatically when its last member is removed.
+    """
+    for keys in scan_batches(r, user_tokens_key('*', '*'), MAINTENANCE_BATCH_SIZE):
+        job.scanned += len(keys)
+        for key in keys:
+            for members in _sscan_batches(r, key, MAINTENANCE_BATCH_SIZE):
+                pipe = r.pipeline(transaction=False)
+                for token_hash in members:
+                    pipe.exists(allowlist_key(token_hash))
+                stale = [m for m, alive in zip(members, pipe.execute()) if not alive]
+                if stale:
+                    job.removed += r.srem(key, *stale)
+        job.batches += 1
+        job.report(r)
+        time.sleep(MAINTENANCE_BATCH_PAUSE)
+
+def _sscan_batches(r, key, count):
+    cursor = 0
+    while True:
+        cursor, members = r.sscan(key, cursor=cursor, count=count)
+        if members:
+            yield list(members)
+        if cursor == 0:
+            break
+
+def clear_rate_limit_keys(job, r):
+    unlink_matching(job, r, "rate_limit*")
+    # Drop the local buckets of every worker, not just this one
+    hybrid_rate_limiter.reset()
+    publish_event(RATE_LIMIT_CHANNEL, {'reset': True})
+
 # ---------- DATABASE HELPERS ----------
+# Connections come from a per-process pool. Pooled connections run in
+# autocommit mode so reads never see a stale snapshot; multi-statement
+# writes open a transaction explicitly with connection.begin().
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))  # seconds waiting for a free connection
+DB_POOL_IDLE_PING = 300  # ping connections idle longer than this (seconds)
+
+class PoolTimeout(Exception):
+    """Raised when no database connection becomes free in time."""
+    pass
+
+class MySQLPool:
+    """Bounded LIFO pool of PyMySQL connections."""
+
+    def __init__(self, config, size, timeout):
+        self.config = {**config, 'autocommit': True}
+        self.size = size
+        self.timeout = timeout
+        self.in_use = 0
+        self.waiting = 0
+        self._idle = []  # (connection, released_at)
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while not self._idle and self.in_use >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_use += 1
+            idle = self._idle.pop() if self._idle else None
+        try:
+            if idle is None:
+                return pymysql.connect(**self.config)
+            connection, released_at = idle
+            if time.monotonic() - released_at > DB_POOL_IDLE_PING:
+                connection.ping(reconnect=True)
+            return connection
+        except Exception:
+            with self._cond:
+                self.in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, connection):
+        """Return a connection; open transactions are rolled back"""
+        keep = connection.open
+        if keep and connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            try:
+                connection.rollback()
+            except Exception:
+                keep = False
+        if not keep:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self._cond:
+            self.in_use -= 1
+            if keep:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def saturation(self):
+        """Fraction of the pool checked out (1.0 = every connection busy)"""
+        return self.in_use / self.size if self.size else 1.0
+
+db_pool = MySQLPool(DB_CONFIG, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(exc):
+    logger.warning("Database pool exhausted: %s", exc)
+    response = jsonify({"msg": "Server busy, please retry"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 def query_db(query, args=(), one=False):
-    connection = pymysql.connect(**DB_CONFIG)
+    connection = db_pool.acquire()
     try:
         with connection.cursor() as cursor:
             cursor.execute(query, args)
             rv = cursor.fetchall()
             return (rv[0] if rv else None) if one else rv
     finally:
-        connection.close()
+        db_pool.release(connection)
 
-def execute_db(query, args=()):
-    connection = pymysql.connect(**DB_CONFIG)
+def execute_db(query, args=(), rowcount=False):
+    connection = db_pool.acquire()
     try:
         with connection.cursor() as cursor:
             cursor.execute(query, args)
             connection.commit()
-            return cursor.lastrowid
+            mark_primary_write()
+            return cursor.rowcount if rowcount else cursor.lastrowid
+    finally:
+        db_pool.release(connection)
+
+# ---------- READ REPLICAS ----------
+# Catalog reads (query_books, image lookups) may go to the replicas listed
+# in DB_REPLICAS ("host[:port],..."; same credentials as DB_CONFIG),
+# round-robin over the ones that are healthy. Everything else, including
+# auth lookups, uses the primary. After a write the client is pinned to the
+# primary for DB_STICKY_SECONDS through a cookie, so it reads its own writes
+# whichever worker answers.
+DB_REPLICAS = [h.strip() for h in os.getenv('DB_REPLICAS', '').split(',') if h.strip()]
+DB_REPLICA_POOL_SIZE = int(os.getenv('DB_REPLICA_POOL_SIZE', str(DB_POOL_SIZE)))
+DB_REPLICA_RETRY_AFTER = float(os.getenv('DB_REPLICA_RETRY_AFTER', '10'))  # seconds a failed replica is skipped
+DB_STICKY_SECONDS = int(os.getenv('DB_STICKY_SECONDS', '5'))
+DB_STICKY_COOKIE = 'db_sticky'
+
+class Replica:
+    """Connection pool of one read replica plus its health state"""
+
+    def __init__(self, address):
+        host, _, port = address.partition(':')
+        config = {**DB_CONFIG, 'host': host}
+        if port:
+            config['port'] = int(port)
+        self.address = address
+        self.pool = MySQLPool(config, DB_REPLICA_POOL_SIZE, DB_POOL_TIMEOUT)
+        self.down_until = 0.0
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def mark_down(self):
+        self.down_until = time.monotonic() + DB_REPLICA_RETRY_AFTER
+
+    def mark_up(self):
+        self.down_until = 0.0
+
+class ReadRouter:
+    """Round-robin choice among healthy replicas"""
+
+    def __init__(self, addresses):
+        self.replicas = [Replica(address) for address in addresses]
+        self._counter = itertools.count()
+
+    def pick(self):
+        """Next healthy replica, or None to read from the primary"""
+        count = len(self.replicas)
+        if not count:
+            return None
+        start = next(self._counter)
+        for offset in range(count):
+            replica = self.replicas[(start + offset) % count]
+            if replica.healthy:
+                return replica
+        return None
+
+read_router = ReadRouter(DB_REPLICAS)
+
+def mark_primary_write():
+    """Pin this client's reads to the primary for the sticky window"""
+    if has_request_context():
+        g.db_wrote = True
+
+def reads_pinned_to_primary():
+    if not has_request_context():
+        return True
+    if g.get('db_wrote'):
+        return True
+    try:
+        return float(request.cookies.get(DB_STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def _fetch_all(pool, sql, params):
+    connection = pool.acquire()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params or ())
+            return cursor.fetchall()
     finally:
-        connection.close()
+        pool.release(connection)
+
+def query_replica(sql, params=None):
+    """Run a read-only catalog query on a replica, falling back to the primary"""
+    replica = None if reads_pinned_to_primary() else read_router.pick()
+    if replica is not None:
+        try:
+            return _fetch_all(replica.pool, sql, params)
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            logger.warning("Replica %s failed, reading from primary: %s", replica.address, e)
+            replica.mark_down()
+        except PoolTimeout:
+            logger.warning("Replica %s pool exhausted, reading from primary", replica.address)
+    return _fetch_all(db_pool, sql, params)
+
+@app.after_request
+def set_sticky_primary_cookie(response):
+    if g.get('db_wrote') and read_router.replicas:
+        response.set_cookie(DB_STICKY_COOKIE, str(int(time.time()) + DB_STICKY_SECONDS),
+                            max_age=DB_STICKY_SECONDS, httponly=True, samesite='Lax')
+    return response
+
+# ---------- REFRESH TOKEN STORE ----------
+# MySQL keeps a 32-byte SHA-256 digest per refresh token (unique index, see
+# migrations/001_refresh_tokens_hash.sql). Expired and revoked rows are
+# deleted in bounded batches by a background job; one worker at a time
+# holds the Redis lock for each run.
+REFRESH_TOKEN_GC_INTERVAL = int(os.getenv('REFRESH_TOKEN_GC_INTERVAL', '300'))  # seconds
+REFRESH_TOKEN_GC_BATCH = int(os.getenv('REFRESH_TOKEN_GC_BATCH', '1000'))
+REFRESH_TOKEN_GC_PAUSE = 0.05  # seconds between batches
+
+def hash_refresh_token(token):
+    """Binary SHA-256 digest stored in refresh_tokens.token_hash"""
+    return hashlib.sha256(token.encode()).digest()
+
+def _delete_in_batches(sql):
+    deleted = 0
+    while True:
+        count = execute_db(sql, (REFRESH_TOKEN_GC_BATCH,), rowcount=True)
+        deleted += count
+        if count < REFRESH_TOKEN_GC_BATCH:
+            return deleted
+        time.sleep(REFRESH_TOKEN_GC_PAUSE)
+
+def gc_refresh_tokens():
+    """Delete expired and revoked refresh tokens"""
+    try:
+        if not get_redis().set("lock:refresh_token_gc", os.getpid(), nx=True, ex=REFRESH_TOKEN_GC_INTERVAL):
+            return  # Another worker ran it recently
+    except Exception:
+        pass  # Without Redis every worker collects; DELETEs are idempotent
+    expired = _delete_in_batches(
+        "DELETE FROM refresh_tokens WHERE expires_at < UTC_TIMESTAMP() LIMIT %s")
+    revoked = _delete_in_batches(
+        "DELETE FROM refresh_tokens WHERE revoked = 1 LIMIT %s")
+    if expired or revoked:
+        logger.info("Refresh token GC: deleted %d expired and %d revoked rows", expired, revoked)
+
+refresh_token_gc = PeriodicTask('refresh-token-gc', REFRESH_TOKEN_GC_INTERVAL, gc_refresh_tokens)
+
+# ---------- PASSWORD HASHING ----------
+# PBKDF2 is CPU-bound and holds the GIL, so hashing runs in a process pool.
+# At most PASSWORD_HASH_MAX_PENDING jobs may be queued per worker; beyond
+# that requests are rejected immediately with 503 instead of piling up.
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))  # 0 = hash inline
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(max(1, PASSWORD_HASH_WORKERS) * 4)))
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '600000'))
+PASSWORD_HASH_METHOD = f"pbkdf2:sha256:{PASSWORD_HASH_ITERATIONS}"
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))  # seconds
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool queue is full."""
+    pass
+
+class PasswordHasherPool:
+    """Bounded process pool for password hashing, created lazily per process."""
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0  # jobs queued or running in this worker
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    # 'spawn' avoids forking a process that already runs threads
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'))
+                    self.pending = 0
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.pending -= 1
+
+    def run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        executor = self._get_executor()
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise PasswordHashingBusy("Password hashing queue is full")
+            self.pending += 1
+        try:
+            future = executor.submit(func, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+        except FutureTimeoutError as exc:
+            raise PasswordHashingBusy("Password hashing timed out") from exc
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+password_hasher = PasswordHasherPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+def hash_password(password):
+    return password_hasher.run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(pw_hash, password):
+    return password_hasher.run(check_password_hash, pw_hash, password)
+
+def hashing_busy_response():
+    response = jsonify({"msg": "Server busy, please retry"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 # ---------- JWT HELPERS ----------
 def create_access_token(payload: dict):
     exp = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRES_MINUTES)
-    token_payload = {**payload, "exp": exp, "type": "access"}
+    token_payload = {**payload, "exp": exp, "type": "access",
+                     **token_generation_claim(payload.get('user_id'))}
     token = jwt.encode(token_payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
     
     # Add to Redis allowlist
@@ -487,7 +1880,8 @@ def create_access_token(payload: dict):
 
 def create_refresh_token(payload: dict):
     exp = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRES_DAYS)
-    token_payload = {**payload, "exp": exp, "type": "refresh"}
+    token_payload = {**payload, "exp": exp, "type": "refresh",
+                     **token_generation_claim(payload.get('user_id'))}
     token = jwt.encode(token_payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
     
     # Add to Redis allowlist
@@ -553,6 +1947,10 @@ def login_required(f):
             if data.get('type') != 'access':
                 logger.warning("Token used is not access token")
                 return jsonify({"msg": "Invalid token type"}), 401
+
+            if is_token_generation_revoked(data):
+                logger.warning("Token generation revoked for user_id=%s", data.get('user_id'))
+                return jsonify({"msg": "Token has been revoked"}), 401
             
             user = query_db("SELECT id, username, email, created_at FROM users WHERE id = %s", (data['user_id'],), one=True)
             if not user:
@@ -569,56 +1967,296 @@ def login_required(f):
             return jsonify({"msg": "Invalid token"}), 401
     return decorated
 
+def admin_required(f):
+    """Restrict an endpoint to the admin user (must wrap login_required)"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        # Simple admin check (you might want to implement proper admin roles)
+        if g.current_user['id'] != 1:  # Assuming user_id 1 is admin
+            return jsonify({"msg": "Admin access required"}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+# ---------- IDEMPOTENCY KEYS ----------
+# A write sent with an `Idempotency-Key` header runs once per user and key.
+# The first request claims the key in Redis (SET NX) and stores its response
+# for IDEMPOTENCY_TTL; concurrent duplicates poll until it is stored and
+# later ones get it replayed (Idempotent-Replayed: true). Reusing a key with
+# a different body is rejected. 5xx responses and exceptions release the key
+# so the client can retry. Without Redis requests run normally.
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))  # seconds a response is replayed
+IDEMPOTENCY_LOCK_TTL = int(os.getenv('IDEMPOTENCY_LOCK_TTL', '120'))  # in-flight claim, > slowest request
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', '30'))  # seconds a duplicate waits for the first
+IDEMPOTENCY_KEY_MAX = 255
+
+def idempotency_redis_key(user_id, key):
+    digest = base64.urlsafe_b64encode(hashlib.sha256(key.encode()).digest()[:16]).rstrip(b'=').decode()
+    return f"idem:{user_id}:{digest}"
+
+def _replay(record):
+    response = Response(base64.b64decode(record['body']), status=record['status'],
+                        mimetype=record['mimetype'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _wait_for_idempotent_response(r, redis_key, fingerprint):
+    """Poll until the in-flight request stores its response; None if it gave up"""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+    delay = 0.05
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+        raw = r.get(redis_key)
+        if raw is None:
+            return None  # the first request failed and released the key
+        record = json.loads(raw)
+        if record['state'] == 'done':
+            return record
+    return {'state': 'timeout', 'fp': fingerprint}
+
+def request_fingerprint():
+    """Hash identifying a request's content for Idempotency-Key reuse checks.
+
+    Multipart bodies are hashed from the parsed form and file contents: the
+    boundary is random per send, so the raw body differs on every retry.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.path}\n".encode())
+    if request.mimetype == 'multipart/form-data':
+        digest.update(f"book={request.form.get('book', '')}\n".encode())
+        for field, storage in sorted(request.files.items(multi=True), key=lambda item: item[0]):
+            content = hashlib.sha256()
+            storage.stream.seek(0)
+            for chunk in iter(lambda: storage.stream.read(65536), b''):
+                content.update(chunk)
+            storage.stream.seek(0)
+            digest.update(f"{field}:{storage.filename}:{storage.mimetype}:{content.hexdigest()}\n".encode())
+    else:
+        # Cached so the body can still be parsed afterwards
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+def idempotent(f):
+    """Run the view at most once per (user, Idempotency-Key); must wrap login_required"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or g.get('idempotency_handled'):
+            return f(*args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX:
+            return jsonify({"msg": f"Idempotency-Key longer than {IDEMPOTENCY_KEY_MAX} characters"}), 400
+        g.idempotency_handled = True  # views that call other idempotent views
+
+        fingerprint = request_fingerprint()
+        redis_key = idempotency_redis_key(g.current_user['id'], key)
+        try:
+            r = get_redis()
+            claimed = r.set(redis_key, json.dumps({'state': 'pending', 'fp': fingerprint}),
+                            nx=True, ex=IDEMPOTENCY_LOCK_TTL)
+        except Exception as e:
+            logger.warning("Idempotency unavailable, running request: %s", e)
+            return f(*args, **kwargs)
+
+        if not claimed:
+            # The key is taken, so running the request without Redis could
+            # repeat it: ask the client to retry instead
+            try:
+                raw = r.get(redis_key)
+                record = json.loads(raw) if raw else None
+                if record is not None and record['state'] == 'pending' and record['fp'] == fingerprint:
+                    record = _wait_for_idempotent_response(r, redis_key, fingerprint)
+                # Released in the meantime: claim it again
+                reclaimed = record is None and r.set(
+                    redis_key, json.dumps({'state': 'pending', 'fp': fingerprint}),
+                    nx=True, ex=IDEMPOTENCY_LOCK_TTL)
+            except Exception as e:
+                logger.warning("Idempotency record unavailable: %s", e)
+                response = jsonify({"msg": "Idempotency store unavailable, please retry"})
+                response.headers['Retry-After'] = '1'
+                return response, 503
+            if record is not None and record['fp'] != fingerprint:
+                return jsonify({"msg": "Idempotency-Key reused with a different request"}), 422
+            if record is not None and record['state'] == 'done':
+                return _replay(record)
+            if record is not None:
+                response = jsonify({"msg": "A request with this Idempotency-Key is still in progress"})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+            if not reclaimed:
+                return jsonify({"msg": "A request with this Idempotency-Key is still in progress"}), 409
+
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except Exception:
+            r.delete(redis_key)
+            raise
+        try:
+            if response.status_code >= 500 or response.is_streamed:
+                r.delete(redis_key)
+            else:
+                r.set(redis_key, json.dumps({
+                    'state': 'done',
+                    'fp': fingerprint,
+                    'status': response.status_code,
+                    'mimetype': response.mimetype,
+                    'body': base64.b64encode(response.get_data()).decode()
+                }), ex=IDEMPOTENCY_TTL)
+        except Exception as e:
+            logger.error("Failed to store idempotent response: %s", e)
+        return response
+    return decorated
+
+# ---------- BACKGROUND TASK STARTUP ----------
+@app.before_request
+def start_background_tasks():
+    # Cheap when already running; restarts threads in freshly forked workers
+    refresh_token_gc.ensure_started()
+    health_prober.ensure_started()
+    tombstone_gc.ensure_started()
+
 # ---------- CORS HANDLER ----------
 @app.before_request
 def handle_preflight():
     if request.method == "OPTIONS":
         response = Response()
         response.headers.add("Access-Control-Allow-Origin", "*")
-        response.headers.add('Access-Control-Allow-Headers', "Content-Type,Authorization,Accept")
+        response.headers.add('Access-Control-Allow-Headers', "Content-Type,Authorization,Accept,Idempotency-Key")
         response.headers.add('Access-Control-Allow-Methods', "GET,PUT,POST,DELETE,OPTIONS")
         return response
 
 # ---------- HEALTHCHECK ----------
-@app.route('/api/health', methods=['GET'])
-def health():
-    """Enhanced health endpoint: checks DB and Redis connectivity"""
-    db_ok = False
-    redis_ok = False
-    
-    # Check MySQL
-    try:
-        connection = pymysql.connect(**DB_CONFIG)
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT 1')
-        connection.close()
-        db_ok = True
-        logger.info("Health check OK: DB reachable")
-    except Exception as e:
-        logger.exception("Health check failed: DB not reachable")
-        db_ok = False
-    
-    # Check Redis
-    if redis_available():
+# A background prober checks MySQL and Redis every HEALTH_PROBE_INTERVAL
+# seconds; the health routes only read its last result, so frequent polling
+# (load tests, monitors, orchestrator probes) costs no connections.
+HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', '5'))
+HEALTH_STALE_AFTER = float(os.getenv('HEALTH_STALE_AFTER', str(HEALTH_PROBE_INTERVAL * 3)))
+READY_MAX_POOL_SATURATION = float(os.getenv('READY_MAX_POOL_SATURATION', '0.9'))
+READY_MAX_HASH_SATURATION = float(os.getenv('READY_MAX_HASH_SATURATION', '0.9'))
+
+health_state = {
+    'db': None,  # None until the first probe
+    'redis': None,
+    'db_latency_ms': None,
+    'redis_latency_ms': None,
+    'checked_at': None,  # time.time() of the last probe
+}
+health_probe_lock = threading.Lock()
+
+def probe_health():
+    """Check MySQL and Redis once and publish the result in health_state"""
+    with health_probe_lock:
+        result = {}
+        start = time.perf_counter()
+        try:
+            connection = db_pool.acquire()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            finally:
+                db_pool.release(connection)
+            result['db'] = True
+            result['db_latency_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        except PoolTimeout:
+            # Every connection busy: the database is not known to be down
+            result['db'] = health_state['db']
+        except Exception:
+            if health_state['db'] is not False:
+                logger.exception("Health check failed: DB not reachable")
+            result['db'] = False
+            result['db_latency_ms'] = None
+
+        start = time.perf_counter()
         try:
             get_redis().ping()
-            redis_ok = True
-            logger.info("Health check OK: Redis reachable")
-        except Exception as e:
-            logger.exception("Health check failed: Redis not reachable")
-            redis_ok = False
-    else:
-        redis_ok = False
-        logger.warning("Redis not configured")
+            result['redis'] = True
+            result['redis_latency_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        except Exception:
+            if health_state['redis'] is not False:
+                logger.warning("Health check failed: Redis not reachable")
+            result['redis'] = False
+            result['redis_latency_ms'] = None
+
+        for replica in read_router.replicas:
+            try:
+                _fetch_all(replica.pool, 'SELECT 1', None)
+                replica.mark_up()
+            except PoolTimeout:
+                pass
+            except Exception as e:
+                if replica.healthy:
+                    logger.warning("Health check failed: replica %s not reachable: %s", replica.address, e)
+                replica.mark_down()
+
+        result['checked_at'] = time.time()
+        health_state.update(result)
+
+health_prober = PeriodicTask('health-prober', HEALTH_PROBE_INTERVAL, probe_health, run_immediately=True)
+
+def current_health():
+    """Last probe result; probes inline only if the prober has no result yet"""
+    if health_state['checked_at'] is None:
+        probe_health()
+    return health_state
 
+def hashing_saturation():
+    if password_hasher.workers <= 0 or not password_hasher.max_pending:
+        return 0.0
+    return password_hasher.pending / password_hasher.max_pending
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Health summary (DB and Redis) from the background prober"""
+    state = current_health()
+    db_ok = bool(state['db'])
+    redis_ok = bool(state['redis'])
     status = "ok" if (db_ok and redis_ok) else "degraded" if db_ok else "error"
     return jsonify({
         "status": status,
         "db": "ok" if db_ok else "error",
         "redis": "ok" if redis_ok else "error",
-        "time": datetime.utcnow().isoformat() + "Z"
+        "time": datetime.utcfromtimestamp(state['checked_at']).isoformat() + "Z"
     }), (200 if db_ok else 500)
 
+@app.route('/api/health/live', methods=['GET'])
+def health_live():
+    """Liveness: the worker answers requests (no dependency checks)"""
+    return jsonify({"status": "alive", "pid": os.getpid()}), 200
+
+@app.route('/api/health/ready', methods=['GET'])
+def health_ready():
+    """Readiness: DB reachable, probe fresh and this worker not saturated"""
+    state = current_health()
+    age = time.time() - state['checked_at']
+    pool_saturation = db_pool.saturation()
+    hash_saturation = hashing_saturation()
+
+    reasons = []
+    if not state['db']:
+        reasons.append("db unreachable")
+    if age > HEALTH_STALE_AFTER:
+        reasons.append("health probe stale")
+    if pool_saturation >= READY_MAX_POOL_SATURATION or db_pool.waiting:
+        reasons.append("db pool saturated")
+    if hash_saturation >= READY_MAX_HASH_SATURATION:
+        reasons.append("password hashing queue saturated")
+
+    return jsonify({
+        "status": "ready" if not reasons else "not_ready",
+        "reasons": reasons,
+        "db": bool(state['db']),
+        "redis": bool(state['redis']),
+        "db_latency_ms": state['db_latency_ms'],
+        "redis_latency_ms": state['redis_latency_ms'],
+        "probe_age_s": round(age, 2),
+        "db_pool": {"in_use": db_pool.in_use, "size": db_pool.size, "waiting": db_pool.waiting,
+                    "saturation": round(pool_saturation, 3)},
+        "password_hashing": {"pending": password_hasher.pending, "max_pending": password_hasher.max_pending,
+                             "saturation": round(hash_saturation, 3)},
+        "replicas": [{"address": r.address, "healthy": r.healthy, "in_use": r.pool.in_use}
+                     for r in read_router.replicas],
+        "time": datetime.utcnow().isoformat() + "Z"
+    }), (200 if not reasons else 503)
+
 # ---------- AUTH ENDPOINTS ----------
 @app.route('/api/auth/register', methods=['POST'])
 @swagger_doc({
@@ -644,7 +2282,8 @@ def health():
     'responses': {
         '201': {'description': 'Usuario creado'},
         '400': {'description': 'Campos faltantes'},
-        '409': {'description': 'Usuario duplicado'}
+        '409': {'description': 'Usuario duplicado'},
+        '503': {'description': 'Servidor saturado, reintentar'}
     }
 })
 def register():
@@ -669,7 +2308,11 @@ def register():
         logger.info("Register failed - user exists username/email: %s/%s", username, email)
         return jsonify({"msg": "User with that username or email already exists"}), 409
     
-    pw_hash = generate_password_hash(password)
+    try:
+        pw_hash = hash_password(password)
+    except PasswordHashingBusy:
+        logger.warning("Register rejected - password hashing pool saturated")
+        return hashing_busy_response()
     user_id = execute_db("INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s)",
                          (username, email, pw_hash))
     logger.info("New user registered id=%s username=%s", user_id, username)
@@ -699,7 +2342,8 @@ def register():
     'responses': {
         '200': {'description': 'Tokens emitidos'},
         '400': {'description': 'Campos faltantes'},
-        '401': {'description': 'Credenciales inválidas'}
+        '401': {'description': 'Credenciales inválidas'},
+        '503': {'description': 'Servidor saturado, reintentar'}
     }
 })
 def login():
@@ -729,7 +2373,12 @@ def login():
         logger.info("Login failed - user not found: %s", identifier)
         return jsonify({"msg": "Invalid credentials"}), 401
 
-    if not check_password_hash(user['password_hash'], password):
+    try:
+        password_ok = verify_password(user['password_hash'], password)
+    except PasswordHashingBusy:
+        logger.warning("Login rejected - password hashing pool saturated")
+        return hashing_busy_response()
+    if not password_ok:
         logger.info("Login failed - wrong password for user_id=%s", user['id'])
         return jsonify({"msg": "Invalid credentials"}), 401
 
@@ -743,16 +2392,13 @@ def login():
     access_token = create_access_token(payload)
     refresh_token, refresh_exp = create_refresh_token(payload)
 
-    # Add tokens to Redis allowlist
-    if redis_available():
-        access_exp = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRES_MINUTES)
-        add_token_to_allowlist(access_token, user['id'], 'access', access_exp)
-        add_token_to_allowlist(refresh_token, user['id'], 'refresh', refresh_exp)
-        logger.info("Tokens added to allowlist for user_id=%s", user['id'])
+    # Both tokens were already added to the Redis allowlist by create_*_token
 
     # Store refresh token in MySQL (for backward compatibility)
-    execute_db("INSERT INTO refresh_tokens (user_id, refresh_token, expires_at) VALUES (%s, %s, %s)",
-               (user['id'], refresh_token, refresh_exp.strftime('%Y-%m-%d %H:%M:%S')))
+    execute_db("""
+        INSERT INTO refresh_tokens (user_id, token_hash, expires_at) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE expires_at=VALUES(expires_at)
+    """, (user['id'], hash_refresh_token(refresh_token), refresh_exp.strftime('%Y-%m-%d %H:%M:%S')))
     
     logger.info("Login success for user_id=%s - tokens issued", user['id'])
 
@@ -796,12 +2442,16 @@ def refresh():
         if redis_available() and is_token_in_denylist(refresh_token):
             logger.warning("Refresh token found in denylist")
             return jsonify({"msg": "Refresh token has been revoked"}), 401
+
+        if is_token_generation_revoked(decoded):
+            logger.warning("Refresh token generation revoked for user_id=%s", user_id)
+            return jsonify({"msg": "Refresh token has been revoked"}), 401
         
         # Optimización: Saltar verificación de MySQL si el token JWT es válido
         # Esto es más rápido y permite múltiples sesiones activas
         # Solo verificar MySQL si necesitamos validar revocación explícita
-        # row = query_db("SELECT id, revoked FROM refresh_tokens WHERE user_id = %s AND refresh_token = %s",
-        #                (user_id, refresh_token), one=True)
+        # row = query_db("SELECT id, revoked FROM refresh_tokens WHERE token_hash = %s",
+        #                (hash_refresh_token(refresh_token),), one=True)
         # if row and row['revoked']:
         #     logger.warning("Attempt to use revoked refresh token id=%s", row['id'])
         #     return jsonify({"msg": "Refresh token revoked"}), 401
@@ -812,14 +2462,12 @@ def refresh():
         # Opcional: También crear un nuevo refresh token (rotación de tokens)
         # new_refresh_token, new_refresh_exp = create_refresh_token({"user_id": user_id})
         
-        # Add new access token to Redis allowlist
-        if redis_available():
-            access_exp = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRES_MINUTES)
-            add_token_to_allowlist(access_token, user_id, 'access', access_exp)
-            logger.info("New access token added to allowlist for user_id=%s", user_id)
+        # The new access token was already added to the Redis allowlist by create_access_token
         
         logger.info("Access token refreshed for user_id=%s", user_id)
         return jsonify({"access_token": access_token, "token_type": "bearer", "expires_in_minutes": ACCESS_TOKEN_EXPIRES_MINUTES}), 200
+    except TokenGenerationUnavailable:
+        raise  # 503 from the error handler
     except jwt.ExpiredSignatureError:
         logger.warning("Refresh token expired")
         return jsonify({"msg": "Refresh token expired"}), 401
@@ -844,7 +2492,7 @@ def logout():
                 try:
                     decoded = decode_token(access_token)
                     user_id = decoded.get('user_id')
-                    add_token_to_denylist(access_token, user_id)
+                    add_token_to_denylist(access_token, user_id, decoded.get('exp'))
                 except:
                     pass  # Token might be invalid, but we still want to denylist it
             
@@ -853,13 +2501,14 @@ def logout():
                 try:
                     decoded = decode_token(refresh_token)
                     user_id = decoded.get('user_id')
-                    add_token_to_denylist(refresh_token, user_id)
+                    add_token_to_denylist(refresh_token, user_id, decoded.get('exp'))
                 except:
                     pass
         
         # Also revoke in MySQL for backward compatibility
         if refresh_token:
-            execute_db("UPDATE refresh_tokens SET revoked = 1 WHERE refresh_token = %s", (refresh_token,))
+            execute_db("UPDATE refresh_tokens SET revoked = 1 WHERE token_hash = %s",
+                       (hash_refresh_token(refresh_token),))
         
         logger.info("Logout requested - tokens revoked")
         return jsonify({"msg": "Tokens revoked successfully"}), 200
@@ -889,15 +2538,25 @@ def revoke_all_tokens():
 # ---------- PROTECTED API ENDPOINTS (BOOKS) ----------
 import xml.etree.ElementTree as ET
 
-def dict_to_xml_book(row):
+def dict_to_xml_book(row, fields=None):
+    """<book> element; `fields` (see BOOK_FIELDS) limits the children emitted"""
     book = ET.Element("book", isbn=row['isbn'])
-    ET.SubElement(book, "title").text = row['title']
-    ET.SubElement(book, "author").text = row['author_names']
-    ET.SubElement(book, "publication_year").text = str(row['publication_year'])
-    ET.SubElement(book, "genre").text = row['genre']
-    ET.SubElement(book, "price").text = str(row['price'])
-    ET.SubElement(book, "stock").text = str(row['stock']).lower()
-    ET.SubElement(book, "format").text = row['format']
+    if fields is None or 'title' in fields:
+        ET.SubElement(book, "title").text = row['title']
+    if fields is None or 'author' in fields:
+        ET.SubElement(book, "author").text = row['author_names']
+    if fields is None or 'publication_year' in fields:
+        ET.SubElement(book, "publication_year").text = str(row['publication_year'])
+    if fields is None or 'genre' in fields:
+        ET.SubElement(book, "genre").text = row['genre']
+    if fields is None or 'price' in fields:
+        ET.SubElement(book, "price").text = str(row['price'])
+    if fields is None or 'stock' in fields:
+        ET.SubElement(book, "stock").text = str(row['stock']).lower()
+    if fields is None or 'format' in fields:
+        ET.SubElement(book, "format").text = row['format']
+    if fields is not None and 'images' not in fields:
+        return book
     images_el = ET.SubElement(book, "images")
     for image in row.get('images', []):
         img_el = ET.SubElement(images_el, "image", id=str(image['image_id']))
@@ -908,21 +2567,354 @@ def dict_to_xml_book(row):
         ET.SubElement(img_el, "uploaded_at").text = image['uploaded_at'].isoformat() if image.get('uploaded_at') else ""
     return book
 
-def query_books(sql, params=None):
-    connection = pymysql.connect(**DB_CONFIG)
+# ---------- CATALOG READ MODEL ----------
+# BookCatalog (migrations/002_book_catalog.sql) holds one precomputed row per
+# book, so listings are single-table reads. Writers call
+# refresh_catalog_entries inside their transaction; the admin rebuild
+# recomputes every row in batches and drops rows of deleted books.
+CATALOG_REBUILD_BATCH = int(os.getenv('CATALOG_REBUILD_BATCH', '500'))
+CATALOG_COLUMNS = ("book_id, isbn, title, publication_year, price, stock, genre_id, format_id, "
+                   "genre, format, author_names, image_count")
+
+# ?fields= names (the <book> children) and the catalog columns each needs
+BOOK_FIELDS = {
+    'title': ('title',),
+    'author': ('author_names',),
+    'publication_year': ('publication_year',),
+    'genre': ('genre',),
+    'price': ('price',),
+    'stock': ('stock',),
+    'format': ('format',),
+    'images': ('book_id', 'image_count'),
+}
+
+def parse_fields(args):
+    """Set of requested book fields from ?fields=a,b, or None for all of them"""
+    raw = args.get('fields')
+    if not raw:
+        return None
+    fields = {f.strip() for f in raw.split(',') if f.strip()}
+    unknown = fields - BOOK_FIELDS.keys()
+    if unknown:
+        raise ValueError(f"Campos desconocidos: {', '.join(sorted(unknown))} (válidos: {', '.join(BOOK_FIELDS)})")
+    return fields
+
+def catalog_columns(fields):
+    """SELECT list for the requested fields (isbn is always included)"""
+    if fields is None:
+        return CATALOG_COLUMNS
+    columns = ['isbn'] + [c for name, cols in BOOK_FIELDS.items() if name in fields for c in cols]
+    return ", ".join(dict.fromkeys(columns))
+
+CATALOG_UPSERT_SQL = """
+    INSERT INTO BookCatalog
+        (book_id, isbn, title, publication_year, price, stock, genre_id, format_id,
+         genre, format, author_names, image_count)
+    SELECT b.book_id, b.isbn, b.title, b.publication_year, b.price, b.stock, b.genre_id, b.format_id,
+           g.name, f.name,
+           (SELECT GROUP_CONCAT(a.name ORDER BY ba.author_id SEPARATOR ', ')
+              FROM BookAuthor ba JOIN Author a ON a.author_id = ba.author_id
+             WHERE ba.book_id = b.book_id),
+           (SELECT COUNT(*) FROM BookImage bi WHERE bi.book_id = b.book_id)
+    FROM Book b
+    LEFT JOIN Genre g ON b.genre_id = g.genre_id
+    LEFT JOIN Format f ON b.format_id = f.format_id
+    WHERE {where}
+    ON DUPLICATE KEY UPDATE
+        isbn=VALUES(isbn), title=VALUES(title), publication_year=VALUES(publication_year),
+        price=VALUES(price), stock=VALUES(stock), genre_id=VALUES(genre_id), format_id=VALUES(format_id),
+        genre=VALUES(genre), format=VALUES(format), author_names=VALUES(author_names),
+        image_count=VALUES(image_count){touch}
+"""
+
+def refresh_catalog_entries(cursor, book_ids):
+    """Recompute the catalog rows of `book_ids` (call inside the write transaction)"""
+    if not book_ids:
+        return
+    placeholders = ",".join(["%s"] * len(book_ids))
+    # Always touch updated_at: replacing images may leave every column equal
+    cursor.execute(CATALOG_UPSERT_SQL.format(where=f"b.book_id IN ({placeholders})",
+                                             touch=", updated_at=NOW(6)"), tuple(book_ids))
+
+def rebuild_catalog(job, _r):
+    """Recompute every BookCatalog row, one primary-key range per transaction"""
+    last_id = 0
+    while True:
+        connection = db_pool.acquire()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT book_id FROM Book WHERE book_id > %s ORDER BY book_id LIMIT %s",
+                               (last_id, CATALOG_REBUILD_BATCH))
+                ids = [row['book_id'] for row in cursor.fetchall()]
+                if not ids:
+                    break
+                connection.begin()
+                # updated_at only moves (ON UPDATE) for rows whose values changed
+                cursor.execute(CATALOG_UPSERT_SQL.format(where="b.book_id BETWEEN %s AND %s", touch=""),
+                               (ids[0], ids[-1]))
+                connection.commit()
+        finally:
+            db_pool.release(connection)
+        last_id = ids[-1]
+        job.scanned += len(ids)
+        job.batches += 1
+
+    # Rows whose book no longer exists
+    connection = db_pool.acquire()
     try:
         with connection.cursor() as cursor:
-            cursor.execute(sql, params or ())
-            rows = cursor.fetchall()
-            return rows
+            job.removed += cursor.execute("""
+                DELETE c FROM BookCatalog c
+                LEFT JOIN Book b ON b.book_id = c.book_id
+                WHERE b.book_id IS NULL
+            """)
     finally:
-        connection.close()
+        db_pool.release(connection)
+
+def query_books(sql, params=None):
+    return query_replica(sql, params)
+
+def xml_error(message, status_code=400):
+    response = ET.Element("response")
+    ET.SubElement(response, "status").text = "error"
+    ET.SubElement(response, "message").text = message
+    return Response(ET.tostring(response, encoding="utf-8", xml_declaration=True), mimetype="application/xml"), status_code
+
+# ---------- SINGLE-FLIGHT ----------
+# Identical concurrent catalog reads (same route, query string and replica
+# routing) are computed once: within a worker the first caller runs the
+# query and serialization while the others wait for its bytes. With
+# SINGLEFLIGHT_REDIS=1 the leader also takes a Redis lock and publishes the
+# bytes under a per-round key so waiters in other workers reuse them.
+SINGLEFLIGHT_REDIS = os.getenv('SINGLEFLIGHT_REDIS', '0') == '1'
+SINGLEFLIGHT_WAIT = float(os.getenv('SINGLEFLIGHT_WAIT', '10'))  # seconds before a waiter computes itself
+SINGLEFLIGHT_RESULT_TTL = 5  # seconds the leader's bytes stay readable in Redis
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if flight.done.wait(SINGLEFLIGHT_WAIT):
+                if flight.error is not None:
+                    raise flight.error
+                metrics.inc('singleflight_coalesced_total', ('local',))
+                return flight.result
+            return func()  # leader is stuck; don't pile up behind it
+        try:
+            flight.result = self._run_leader(key, func) if SINGLEFLIGHT_REDIS else func()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _run_leader(self, key, func):
+        """Compute under a Redis lock, or reuse the bytes of the worker holding it"""
+        digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+        lock_key = f"sf:lock:{digest}"
+        token = uuid.uuid4().hex
+        try:
+            r = get_redis()
+            acquired = r.set(lock_key, token, nx=True, ex=max(1, int(SINGLEFLIGHT_WAIT)))
+            result = None if acquired else self._wait_remote(r, lock_key, digest)
+        except Exception as e:
+            logger.warning("Single-flight lock unavailable: %s", e)
+            return func()
+        if not acquired:
+            if result is not None:
+                metrics.inc('singleflight_coalesced_total', ('redis',))
+                return result
+            return func()
+        try:
+            result = func()
+        except Exception:
+            try:
+                r.delete(lock_key)  # let remote waiters compute instead of waiting it out
+            except Exception:
+                pass
+            raise
+        try:
+            r.set(f"sf:result:{digest}:{token}", base64.b64encode(result).decode(), ex=SINGLEFLIGHT_RESULT_TTL)
+            if r.get(lock_key) == token:
+                r.delete(lock_key)
+        except Exception as e:
+            logger.warning("Could not publish single-flight result: %s", e)
+        return result
+
+    @staticmethod
+    def _wait_remote(r, lock_key, digest):
+        """Wait for the round whose lock we saw first; None if its leader failed"""
+        token = r.get(lock_key)
+        if token is None:
+            return None  # that leader finished between our SET NX and this read
+        result_key = f"sf:result:{digest}:{token}"
+        deadline = time.monotonic() + SINGLEFLIGHT_WAIT
+        delay = 0.01
+        while True:
+            # The leader publishes before releasing its lock, so once the lock
+            # is gone the result is either readable now or was never written
+            held = r.get(lock_key) == token
+            data = r.get(result_key)
+            if data is not None:
+                return base64.b64decode(data)
+            if not held or time.monotonic() >= deadline:
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+single_flight = SingleFlight()
+
+# ---------- LISTING CACHE ----------
+# Rendered listing bytes per worker, keyed like single-flight. Entries are
+# fresh for LISTING_CACHE_TTL seconds; for LISTING_CACHE_MAX_STALE seconds
+# more they are still served immediately while one background refresh per
+# key recomputes them (stale-while-revalidate). Older entries are recomputed
+# in the request. Book events (see CHANGE STREAM) clear the cache, and
+# clients pinned to the primary after a write bypass it.
+LISTING_CACHE_TTL = float(os.getenv('LISTING_CACHE_TTL', '5'))  # 0 disables the cache
+LISTING_CACHE_MAX_STALE = float(os.getenv('LISTING_CACHE_MAX_STALE', '30'))
+LISTING_CACHE_MAX_ENTRIES = int(os.getenv('LISTING_CACHE_MAX_ENTRIES', '256'))
+LISTING_REFRESH_WORKERS = int(os.getenv('LISTING_REFRESH_WORKERS', '2'))
+
+class ListingCache:
+    """Per-worker stale-while-revalidate cache of rendered listings"""
+
+    def __init__(self):
+        self._entries = {}  # key: (body, stored_at)
+        self._refreshing = set()
+        self._generation = 0  # bumped on every invalidation
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def get(self, key, render):
+        """Return (body, state) where state is HIT, STALE or MISS"""
+        redis_events.ensure_started()
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[1]
+            if age < LISTING_CACHE_TTL:
+                return entry[0], 'HIT'
+            if age < LISTING_CACHE_TTL + LISTING_CACHE_MAX_STALE:
+                self._schedule_refresh(key, render)
+                return entry[0], 'STALE'
+        generation = self._generation
+        body = single_flight.do(key, render)
+        self._store(key, body, generation)
+        return body, 'MISS'
+
+    def _store(self, key, body, generation):
+        with self._lock:
+            # An invalidation while rendering means `body` may predate it
+            if generation != self._generation:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (body, time.monotonic())
+            while len(self._entries) > LISTING_CACHE_MAX_ENTRIES:
+                self._entries.pop(next(iter(self._entries)))
 
-def books_to_xml(books):
-    library = ET.Element("library")
-    for b in books:
-        library.append(dict_to_xml_book(b))
-    return ET.tostring(library, encoding="utf-8", xml_declaration=True)
+    def _schedule_refresh(self, key, render):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        generation = self._generation
+
+        @copy_current_request_context
+        def refresh():
+            try:
+                self._store(key, single_flight.do(key, render), generation)
+            except Exception:
+                logger.exception("Background refresh of %s failed", key)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        try:
+            self._get_executor().submit(refresh)
+        except RuntimeError:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=LISTING_REFRESH_WORKERS,
+                                                        thread_name_prefix='listing-refresh')
+                    self._refreshing = set()
+                    self._pid = os.getpid()
+        return self._executor
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+listing_cache = ListingCache()
+
+def cached_listing(render):
+    """Serve a catalog listing through the listing cache and single-flight"""
+    key = request_flight_key()
+    if LISTING_CACHE_TTL <= 0 or reads_pinned_to_primary():
+        body, state = single_flight.do(key, render), 'BYPASS'
+    else:
+        body, state = listing_cache.get(key, render)
+    response = Response(body, mimetype="application/xml")
+    response.headers['X-Cache'] = state
+    return response
+
+def request_flight_key():
+    """Route + normalized query string + read routing of the current request"""
+    query = urlencode(sorted(request.args.items(multi=True)))
+    routing = 'primary' if reads_pinned_to_primary() else 'replica'
+    return f"{request.method} {request.path}?{query}|{routing}"
+
+def books_response(sql, params=None, fields=None):
+    """Run a catalog query and return the XML listing, loading images only if requested"""
+    def render():
+        books = query_books(sql, params)
+        if fields is None or 'images' in fields:
+            books = attach_images_to_books(books)
+        return books_to_xml(books, fields)
+    return cached_listing(render)
+
+def books_to_xml(books, fields=None, **attrs):
+    with timed('serialization_duration_seconds', 'xml', 'serialize.xml', books=len(books)):
+        library = ET.Element("library", {k: str(v) for k, v in attrs.items()})
+        for b in books:
+            library.append(dict_to_xml_book(b, fields))
+        return ET.tostring(library, encoding="utf-8", xml_declaration=True)
 
 @app.route("/api/books", methods=["GET"])
 @login_required
@@ -936,6 +2928,13 @@ def books_to_xml(books):
             'type': 'string',
             'required': True,
             'description': 'Bearer <token>'
+        },
+        {
+            'name': 'fields',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Campos a incluir separados por comas (title, author, publication_year, genre, price, stock, format, images); sin images no se consultan imágenes'
         }
     ],
     'responses': {
@@ -945,19 +2944,12 @@ def books_to_xml(books):
 })
 def get_all_books():
     """GET /api/books → muestra todos los libros en formato XML"""
-    sql = """
-        SELECT b.*, g.name AS genre, f.name AS format,
-        GROUP_CONCAT(a.name SEPARATOR ', ') AS author_names
-        FROM Book b
-        LEFT JOIN Genre g ON b.genre_id = g.genre_id
-        LEFT JOIN Format f ON b.format_id = f.format_id
-        LEFT JOIN BookAuthor ba ON b.book_id = ba.book_id
-        LEFT JOIN Author a ON ba.author_id = a.author_id
-        GROUP BY b.book_id
-    """
-    books = query_books(sql)
-    books = attach_images_to_books(books)
-    return Response(books_to_xml(books), mimetype="application/xml")
+    try:
+        fields = parse_fields(request.args)
+    except ValueError as exc:
+        return xml_error(str(exc))
+    sql = f"SELECT {catalog_columns(fields)} FROM BookCatalog ORDER BY book_id"
+    return books_response(sql, (), fields)
 
 @app.route("/api/books/<isbn>", methods=["GET"])
 @login_required
@@ -977,6 +2969,13 @@ def get_all_books():
             'in': 'path',
             'type': 'string',
             'required': True
+        },
+        {
+            'name': 'fields',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Campos a incluir separados por comas (title, author, publication_year, genre, price, stock, format, images); sin images no se consultan imágenes'
         }
     ],
     'responses': {
@@ -986,61 +2985,513 @@ def get_all_books():
 })
 def get_book_by_isbn(isbn):
     """GET /api/books/ISBN → muestra un libro si se manda el ISBN"""
-    sql = """
-        SELECT b.*, g.name AS genre, f.name AS format,
-        GROUP_CONCAT(a.name SEPARATOR ', ') AS author_names
-        FROM Book b
-        LEFT JOIN Genre g ON b.genre_id = g.genre_id
-        LEFT JOIN Format f ON b.format_id = f.format_id
-        LEFT JOIN BookAuthor ba ON b.book_id = ba.book_id
-        LEFT JOIN Author a ON ba.author_id = a.author_id
-        WHERE b.isbn=%s
-        GROUP BY b.book_id
-    """
-    books = query_books(sql, (isbn,))
-    books = attach_images_to_books(books)
-    return Response(books_to_xml(books), mimetype="application/xml")
+    try:
+        fields = parse_fields(request.args)
+    except ValueError as exc:
+        return xml_error(str(exc))
+    sql = f"SELECT {catalog_columns(fields)} FROM BookCatalog WHERE isbn=%s"
+    return books_response(sql, (isbn,), fields)
 
 @app.route("/api/books/format/<format_name>", methods=["GET"])
 @login_required
 def get_books_by_format(format_name):
     """GET /api/books/format/digital → muestra todos los libros con el formato digital"""
-    sql = """
-        SELECT b.*, g.name AS genre, f.name AS format,
-        GROUP_CONCAT(a.name SEPARATOR ', ') AS author_names
-        FROM Book b
-        LEFT JOIN Genre g ON b.genre_id = g.genre_id
-        LEFT JOIN Format f ON b.format_id = f.format_id
-        LEFT JOIN BookAuthor ba ON b.book_id = ba.book_id
-        LEFT JOIN Author a ON ba.author_id = a.author_id
-        WHERE f.name=%s
-        GROUP BY b.book_id
-    """
-    books = query_books(sql, (format_name,))
-    books = attach_images_to_books(books)
-    return Response(books_to_xml(books), mimetype="application/xml")
+    try:
+        fields = parse_fields(request.args)
+    except ValueError as exc:
+        return xml_error(str(exc))
+    sql = f"SELECT {catalog_columns(fields)} FROM BookCatalog WHERE format=%s ORDER BY book_id"
+    return books_response(sql, (format_name,), fields)
 
 @app.route("/api/books/author/<author_name>", methods=["GET"])
 @login_required
 def get_books_by_author(author_name):
     """GET /api/books/author/ → muestra todos los libros de un autor"""
-    sql = """
-        SELECT b.*, g.name AS genre, f.name AS format,
-        GROUP_CONCAT(a.name SEPARATOR ', ') AS author_names
-        FROM Book b
-        LEFT JOIN Genre g ON b.genre_id = g.genre_id
-        LEFT JOIN Format f ON b.format_id = f.format_id
-        LEFT JOIN BookAuthor ba ON b.book_id = ba.book_id
-        LEFT JOIN Author a ON ba.author_id = a.author_id
-        WHERE a.name LIKE %s
-        GROUP BY b.book_id
+    try:
+        fields = parse_fields(request.args)
+    except ValueError as exc:
+        return xml_error(str(exc))
+    sql = f"SELECT {catalog_columns(fields)} FROM BookCatalog WHERE author_names LIKE %s ORDER BY book_id"
+    return books_response(sql, ("%" + author_name + "%",), fields)
+
+BATCH_MAX_ISBNS = int(os.getenv('BATCH_MAX_ISBNS', '100'))
+
+def book_to_dict(row, fields=None):
+    """JSON counterpart of dict_to_xml_book"""
+    data = {
+        "isbn": row['isbn'],
+        "title": row.get('title'),
+        "author": row.get('author_names'),
+        "publication_year": row.get('publication_year'),
+        "genre": row.get('genre'),
+        "price": float(row['price']) if row.get('price') is not None else None,
+        "stock": bool(row['stock']) if row.get('stock') is not None else None,
+        "format": row.get('format'),
+        "images": [{
+            "id": image['image_id'],
+            "url": image['signed_url'],
+            "filename": image['filename'],
+            "mime_type": image['mime_type'],
+            "size_bytes": image['size_bytes'],
+            "uploaded_at": image['uploaded_at'].isoformat() if image.get('uploaded_at') else None
+        } for image in row.get('images', [])]
+    }
+    if fields is not None:
+        data = {k: v for k, v in data.items() if k == 'isbn' or k in fields}
+    return data
+
+def parse_isbn_batch():
+    """Return (isbns, as_json) from an XML <isbns><isbn>..</isbn></isbns> or JSON {"isbns": [..]} body"""
+    if request.is_json:
+        body = request.get_json(silent=True)
+        isbns = body.get('isbns') if isinstance(body, dict) else None
+        if not isinstance(isbns, list) or not all(isinstance(i, str) for i in isbns):
+            raise ValueError('Se esperaba {"isbns": ["..."]}')
+        as_json = True
+    else:
+        try:
+            root = ET.fromstring(request.data)
+        except ET.ParseError as exc:
+            raise ValueError(f"XML inválido: {exc}") from exc
+        isbns = [(i.text or '') for i in root.findall("isbn")]
+        as_json = False
+    isbns = [i.strip() for i in isbns if i and i.strip()]
+    if not isbns:
+        raise ValueError("No se recibió ningún ISBN")
+    if len(isbns) > BATCH_MAX_ISBNS:
+        raise ValueError(f"Máximo {BATCH_MAX_ISBNS} ISBN por petición")
+    return isbns, as_json
+
+@app.route("/api/books/batch", methods=["POST"])
+@login_required
+@swagger_doc({
+    'tags': ['Books'],
+    'summary': 'Obtener varios libros por ISBN en una sola petición',
+    'consumes': ['application/xml', 'application/json'],
+    'parameters': [
+        {'name': 'Authorization', 'in': 'header', 'type': 'string', 'required': True,
+         'description': 'Bearer <token>'},
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'string',
+                'example': '<isbns><isbn>9781234567890</isbn><isbn>9780987654321</isbn></isbns>'
+            },
+            'description': 'XML con etiquetas <isbn> o JSON {"isbns": [...]}; la respuesta usa el mismo formato'
+        }
+    ],
+    'responses': {
+        '200': {'description': 'Libros en el orden pedido; los ISBN inexistentes se marcan como no encontrados'},
+        '400': {'description': 'Cuerpo inválido o demasiados ISBN'},
+        '401': {'description': 'Token inválido o ausente'}
+    }
+})
+def get_books_batch():
+    """POST /api/books/batch → varios libros por ISBN con una sola consulta"""
+    try:
+        isbns, as_json = parse_isbn_batch()
+        fields = parse_fields(request.args)
+    except ValueError as exc:
+        if request.is_json:
+            return jsonify({"msg": str(exc)}), 400
+        return xml_error(str(exc))
+
+    unique = list(dict.fromkeys(isbns))
+    placeholders = ",".join(["%s"] * len(unique))
+    sql = f"SELECT {catalog_columns(fields)} FROM BookCatalog WHERE isbn IN ({placeholders})"
+    books = query_books(sql, tuple(unique))
+    if fields is None or 'images' in fields:
+        books = attach_images_to_books(books)
+    by_isbn = {b['isbn']: b for b in books}
+
+    if as_json:
+        return jsonify({
+            "books": [book_to_dict(by_isbn[i], fields) if i in by_isbn else {"isbn": i, "found": False} for i in isbns],
+            "found": sum(1 for i in isbns if i in by_isbn),
+            "requested": len(isbns)
+        }), 200
+
+    with timed('serialization_duration_seconds', 'xml', 'serialize.xml', books=len(books)):
+        library = ET.Element("library", requested=str(len(isbns)))
+        for isbn in isbns:
+            if isbn in by_isbn:
+                library.append(dict_to_xml_book(by_isbn[isbn], fields))
+            else:
+                ET.SubElement(library, "not_found", isbn=isbn)
+        body = ET.tostring(library, encoding="utf-8", xml_declaration=True)
+    return Response(body, mimetype="application/xml")
+
+# Sort keys accepted by /api/books/search; book_id breaks ties so pages are stable
+SEARCH_SORTS = {
+    'id': 'book_id',
+    'title': 'title, book_id',
+    '-title': 'title DESC, book_id DESC',
+    'year': 'publication_year, book_id',
+    '-year': 'publication_year DESC, book_id DESC',
+    'price': 'price, book_id',
+    '-price': 'price DESC, book_id DESC',
+}
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _search_number(args, name, cast):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        number = cast(value)
+    except ValueError:
+        raise ValueError(f"Parámetro '{name}' inválido: {value}")
+    if not math.isfinite(number):  # float() accepts nan/inf
+        raise ValueError(f"Parámetro '{name}' inválido: {value}")
+    return number
+
+def build_search_query(args, columns=CATALOG_COLUMNS):
+    """Translate search query params into one BookCatalog query.
+
+    Returns (sql, params, limit, offset). The query fetches limit + 1 rows so
+    the caller can tell whether another page exists. Raises ValueError on
+    invalid parameters.
+    """
+    clauses, params = [], []
+    for column in ('genre', 'format'):
+        if args.get(column):
+            clauses.append(f"{column} = %s")
+            params.append(args.get(column))
+    if args.get('title'):
+        clauses.append("title LIKE %s")  # prefix match: can use the title index
+        params.append(_escape_like(args.get('title')) + '%')
+    if args.get('author'):
+        clauses.append("author_names LIKE %s")
+        params.append('%' + _escape_like(args.get('author')) + '%')
+    for name, column, op, cast in (('year_min', 'publication_year', '>=', int),
+                                   ('year_max', 'publication_year', '<=', int),
+                                   ('price_min', 'price', '>=', float),
+                                   ('price_max', 'price', '<=', float)):
+        value = _search_number(args, name, cast)
+        if value is not None:
+            clauses.append(f"{column} {op} %s")
+            params.append(value)
+    in_stock = args.get('in_stock')
+    if in_stock not in (None, ''):
+        if in_stock.lower() not in ('true', 'false', '1', '0'):
+            raise ValueError(f"Parámetro 'in_stock' inválido: {in_stock}")
+        clauses.append("stock = %s")
+        params.append(1 if in_stock.lower() in ('true', '1') else 0)
+
+    sort = args.get('sort') or 'id'
+    if sort not in SEARCH_SORTS:
+        raise ValueError(f"Orden inválido: {sort} (válidos: {', '.join(SEARCH_SORTS)})")
+    limit = _search_number(args, 'limit', int)
+    limit = SEARCH_DEFAULT_LIMIT if limit is None else limit
+    offset = _search_number(args, 'offset', int)
+    offset = 0 if offset is None else offset
+    if not 1 <= limit <= SEARCH_MAX_LIMIT or offset < 0:
+        raise ValueError(f"limit debe estar entre 1 y {SEARCH_MAX_LIMIT} y offset no puede ser negativo")
+
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"SELECT {columns} FROM BookCatalog{where} ORDER BY {SEARCH_SORTS[sort]} LIMIT %s OFFSET %s"
+    return sql, params + [limit + 1, offset], limit, offset
+
+@app.route("/api/books/search", methods=["GET"])
+@login_required
+@swagger_doc({
+    'tags': ['Books'],
+    'summary': 'Buscar libros combinando filtros',
+    'parameters': [
+        {'name': 'Authorization', 'in': 'header', 'type': 'string', 'required': True,
+         'description': 'Bearer <token>'},
+        {'name': 'genre', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'format', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'author', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Subcadena del nombre de algún autor'},
+        {'name': 'title', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Prefijo del título'},
+        {'name': 'year_min', 'in': 'query', 'type': 'integer', 'required': False},
+        {'name': 'year_max', 'in': 'query', 'type': 'integer', 'required': False},
+        {'name': 'price_min', 'in': 'query', 'type': 'number', 'required': False},
+        {'name': 'price_max', 'in': 'query', 'type': 'number', 'required': False},
+        {'name': 'in_stock', 'in': 'query', 'type': 'boolean', 'required': False},
+        {'name': 'sort', 'in': 'query', 'type': 'string', 'required': False,
+         'enum': list(SEARCH_SORTS), 'default': 'id'},
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False,
+         'default': SEARCH_DEFAULT_LIMIT},
+        {'name': 'offset', 'in': 'query', 'type': 'integer', 'required': False, 'default': 0},
+        {'name': 'fields', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Campos a incluir separados por comas (ver /api/books)'}
+    ],
+    'responses': {
+        '200': {'description': 'Página de resultados (XML); <library> lleva offset, limit y has_more'},
+        '400': {'description': 'Parámetros inválidos'},
+        '401': {'description': 'Token inválido o ausente'}
+    }
+})
+def search_books():
+    """GET /api/books/search?genre=...&year_min=...&sort=-price → búsqueda combinada"""
+    try:
+        fields = parse_fields(request.args)
+        sql, params, limit, offset = build_search_query(request.args, catalog_columns(fields))
+    except ValueError as exc:
+        return xml_error(str(exc))
+
+    def render():
+        books = query_books(sql, tuple(params))
+        has_more = len(books) > limit
+        books = books[:limit]
+        if fields is None or 'images' in fields:
+            books = attach_images_to_books(books)
+        return books_to_xml(books, fields, offset=offset, limit=limit, has_more=str(has_more).lower())
+    return cached_listing(render)
+
+# ---------- CHANGE FEED ----------
+# Cursors are opaque: microseconds of the database clock. A page covers
+# (since, until] with `until` held CHANGES_SAFETY_LAG seconds behind the
+# database clock so rows of transactions still committing are not skipped;
+# they appear on the next call. Reads go to the primary: a lagging replica
+# would hand out cursors past rows it has not applied yet.
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 1000
+CHANGES_SAFETY_LAG = float(os.getenv('CHANGES_SAFETY_LAG', '2'))  # seconds
+CHANGES_RETENTION_DAYS = int(os.getenv('CHANGES_RETENTION_DAYS', '30'))
+CURSOR_EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(dt):
+    return str((dt - CURSOR_EPOCH) // timedelta(microseconds=1))
+
+def decode_cursor(value):
+    try:
+        return CURSOR_EPOCH + timedelta(microseconds=int(value))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Cursor inválido: {value}")
+
+def _changes_page(sql, columns, since, until, limit):
+    """Rows of `sql` with since < ts <= until, cut after `limit` rows at a timestamp boundary.
+
+    Returns (rows, until) where every row with ts <= until is included.
     """
-    books = query_books(sql, ("%" + author_name + "%",))
-    books = attach_images_to_books(books)
-    return Response(books_to_xml(books), mimetype="application/xml")
+    rows = query_db(sql.format(columns=columns) + " LIMIT %s", (since, until, limit + 1))
+    if len(rows) <= limit:
+        return rows, until
+    # Many rows can share a timestamp (one statement); never split them
+    until = rows[limit - 1]['ts']
+    return query_db(sql.format(columns=columns), (since, until)), until
+
+def gc_tombstones():
+    deleted = _delete_in_batches(
+        f"DELETE FROM BookTombstone WHERE deleted_at < NOW(6) - INTERVAL {CHANGES_RETENTION_DAYS} DAY LIMIT %s")
+    if deleted:
+        logger.info("Tombstone GC: deleted %d rows", deleted)
+
+tombstone_gc = PeriodicTask('tombstone-gc', 3600, gc_tombstones)
+
+@app.route("/api/books/changes", methods=["GET"])
+@login_required
+@swagger_doc({
+    'tags': ['Books'],
+    'summary': 'Cambios del catálogo desde un cursor',
+    'parameters': [
+        {'name': 'Authorization', 'in': 'header', 'type': 'string', 'required': True,
+         'description': 'Bearer <token>'},
+        {'name': 'since', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Cursor devuelto por la llamada anterior; sin él se devuelve todo el catálogo paginado'},
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False,
+         'default': CHANGES_DEFAULT_LIMIT},
+        {'name': 'fields', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Campos a incluir en los libros modificados (ver /api/books)'}
+    ],
+    'responses': {
+        '200': {'description': '<changes cursor="..." has_more="..."> con <upserts> y <deletes>'},
+        '400': {'description': 'Cursor o parámetros inválidos'},
+        '410': {'description': 'Cursor más antiguo que la retención de borrados: volver a sincronizar'}
+    }
+})
+def get_book_changes():
+    """GET /api/books/changes?since=<cursor> → altas/cambios y bajas desde el cursor"""
+    try:
+        fields = parse_fields(request.args)
+        since = decode_cursor(request.args['since']) if request.args.get('since') else CURSOR_EPOCH
+        try:
+            limit = int(request.args.get('limit', CHANGES_DEFAULT_LIMIT))
+        except ValueError:
+            raise ValueError("limit debe ser un entero")
+        if not 1 <= limit <= CHANGES_MAX_LIMIT:
+            raise ValueError(f"limit debe estar entre 1 y {CHANGES_MAX_LIMIT}")
+    except ValueError as exc:
+        return xml_error(str(exc))
+
+    now = query_db("SELECT NOW(6) AS now", one=True)['now']
+    if since != CURSOR_EPOCH and since < now - timedelta(days=CHANGES_RETENTION_DAYS):
+        return xml_error("Cursor expirado: volver a descargar /api/books", 410)
+    until = max(since, now - timedelta(seconds=CHANGES_SAFETY_LAG))
+
+    upserts, upserts_until = _changes_page(
+        "SELECT {columns}, updated_at AS ts FROM BookCatalog"
+        " WHERE updated_at > %s AND updated_at <= %s ORDER BY updated_at, book_id",
+        catalog_columns(fields), since, until, limit)
+    deletes, deletes_until = _changes_page(
+        "SELECT {columns}, deleted_at AS ts FROM BookTombstone"
+        " WHERE deleted_at > %s AND deleted_at <= %s ORDER BY deleted_at, seq",
+        "isbn", since, until, limit)
+    # Both lists are complete up to the smaller bound
+    page_until = min(upserts_until, deletes_until)
+    has_more = page_until < until
+    upserts = [b for b in upserts if b['ts'] <= page_until]
+    deletes = [d for d in deletes if d['ts'] <= page_until]
+    if fields is None or 'images' in fields:
+        upserts = attach_images_to_books(upserts)
+
+    with timed('serialization_duration_seconds', 'xml', 'serialize.xml', books=len(upserts)):
+        root = ET.Element("changes", cursor=encode_cursor(page_until), has_more=str(has_more).lower())
+        upserts_el = ET.SubElement(root, "upserts")
+        for book in upserts:
+            book_el = dict_to_xml_book(book, fields)
+            book_el.set("updated_at", book['ts'].isoformat())
+            upserts_el.append(book_el)
+        deletes_el = ET.SubElement(root, "deletes")
+        for tombstone in deletes:
+            ET.SubElement(deletes_el, "book", isbn=tombstone['isbn'], deleted_at=tombstone['ts'].isoformat())
+        body = ET.tostring(root, encoding="utf-8", xml_declaration=True)
+    return Response(body, mimetype="application/xml")
+
+# ---------- CHANGE STREAM (SSE) ----------
+# insert_book/update_book/delete_books publish {isbn, op, version} on
+# BOOK_EVENTS_CHANNEL after committing. Each worker's RedisEventListener
+# fans the messages out to its local /api/books/stream subscribers, so any
+# worker can serve any client. `version` is a /api/books/changes cursor:
+# after a "resync" event (listener reconnect or slow consumer) clients catch
+# up from their last version.
+#
+# In the threaded servers every open stream holds a worker thread, so only
+# SSE_MAX_STREAMS_THREADED streams are allowed per worker; run
+# async_server.py (or gunicorn with gevent workers) to hold many idle
+# streams as greenlets.
+BOOK_EVENTS_CHANNEL = 'books:events'
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', '15'))  # seconds between keep-alive comments
+SSE_MAX_DURATION = float(os.getenv('SSE_MAX_DURATION', '300'))  # clients reconnect after this
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', '1000'))
+SSE_MAX_STREAMS_THREADED = int(os.getenv('SSE_MAX_STREAMS_THREADED', '2'))
+SSE_QUEUE_SIZE = 100  # events buffered per subscriber before it must resync
+
+def publish_book_event(op, isbn, version):
+    listing_cache.clear()  # this worker at once; the others on the event
+    publish_event(BOOK_EVENTS_CHANNEL, {'isbn': isbn, 'op': op, 'version': version})
+
+class _Subscriber:
+    __slots__ = ('queue', 'overflowed')
+
+    def __init__(self):
+        self.queue = queue.Queue(SSE_QUEUE_SIZE)
+        self.overflowed = False
+
+class BookEventHub:
+    """Per-worker fan-out of book events to open SSE streams"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        return len(self._subscribers)
+
+    def subscribe(self, limit):
+        """Register a stream, or return None when `limit` streams are open"""
+        with self._lock:
+            if len(self._subscribers) >= limit:
+                return None
+            subscriber = _Subscriber()
+            self._subscribers.add(subscriber)
+        redis_events.ensure_started()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def on_message(self, data):
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(data)
+            except queue.Full:
+                subscriber.overflowed = True
+
+    def on_gap(self):
+        """Events may have been missed: every stream tells its client to resync"""
+        for subscriber in list(self._subscribers):
+            subscriber.overflowed = True
+
+book_events = BookEventHub()
+
+def on_book_event(data):
+    listing_cache.clear()
+    book_events.on_message(data)
+
+def on_book_events_gap():
+    # Invalidations may have been missed while disconnected
+    listing_cache.clear()
+    book_events.on_gap()
+
+redis_events.register(BOOK_EVENTS_CHANNEL, on_book_event, on_book_events_gap, on_book_events_gap)
+
+@app.route("/api/books/stream", methods=["GET"])
+@login_required
+@swagger_doc({
+    'tags': ['Books'],
+    'summary': 'Stream SSE de cambios del catálogo',
+    'produces': ['text/event-stream'],
+    'parameters': [
+        {'name': 'Authorization', 'in': 'header', 'type': 'string', 'required': True,
+         'description': 'Bearer <token>'}
+    ],
+    'responses': {
+        '200': {'description': 'Eventos "book" con {isbn, op, version}; "resync" si hay que pedir /api/books/changes'},
+        '503': {'description': 'Demasiados streams abiertos en este worker'}
+    }
+})
+def stream_book_events():
+    """GET /api/books/stream → Server-Sent Events con los cambios del catálogo"""
+    limit = SSE_MAX_STREAMS if gevent_patched() else SSE_MAX_STREAMS_THREADED
+    subscriber = book_events.subscribe(limit)
+    if subscriber is None:
+        response = jsonify({"msg": "Too many open streams, please retry"})
+        response.headers['Retry-After'] = str(int(SSE_HEARTBEAT))
+        return response, 503
+
+    deadline = time.monotonic() + SSE_MAX_DURATION
+    expires_at = token_expiry(request.headers['Authorization'].split()[1])
+    if expires_at:
+        deadline = min(deadline, time.monotonic() + max(0, expires_at - time.time()))
+
+    def generate():
+        try:
+            yield f"retry: {int(SSE_HEARTBEAT * 1000)}\n\n"
+            while True:
+                if subscriber.overflowed:
+                    yield "event: resync\ndata: {}\n\n"
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    data = subscriber.queue.get(timeout=min(SSE_HEARTBEAT, remaining))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {json.loads(data)['version']}\nevent: book\ndata: {data}\n\n"
+        finally:
+            book_events.unsubscribe(subscriber)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route("/api/books/insert", methods=["PUT"])
 @login_required
+@idempotent
 @swagger_doc({
     'tags': ['Books'],
     'summary': 'Insertar o actualizar un libro',
@@ -1053,6 +3504,13 @@ def get_books_by_author(author_name):
             'required': True,
             'description': 'Bearer <token>'
         },
+        {
+            'name': 'Idempotency-Key',
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'Clave única por operación; los reintentos con la misma clave devuelven la respuesta original'
+        },
         {
             'name': 'book',
             'in': 'formData',
@@ -1076,8 +3534,6 @@ def get_books_by_author(author_name):
 })
 def insert_book():
     """PUT /api/books/insert → inserta o actualiza un libro (upsert)"""
-    logger.info("📚 Insert book endpoint called - Headers: %s", dict(request.headers))
-    
     # Get user from decorator validation
     user = g.current_user
     logger.info("✅ User authenticated: %s", user.get('username'))
@@ -1113,30 +3569,35 @@ def insert_book():
 
     new_objects = []
     old_objects = []
-    connection = pymysql.connect(**DB_CONFIG)
+    connection = db_pool.acquire()
     try:
+        connection.begin()
         with connection.cursor() as cursor:
-            # Insert Genre
-            logger.info("🔍 Inserting genre: %s", genre)
-            cursor.execute("INSERT INTO Genre(name) VALUES(%s) ON DUPLICATE KEY UPDATE name=name", (genre,))
-            cursor.execute("SELECT genre_id FROM Genre WHERE name=%s", (genre,))
-            genre_result = cursor.fetchone()
-            logger.info("🔍 Genre result: %s", genre_result)
-            if not genre_result:
-                raise ValueError(f"Failed to create or find genre '{genre}'")
-            genre_id = genre_result['genre_id']
-            logger.info("✅ Genre ID: %s", genre_id)
+            with trace_span('book.resolve_genre_format', genre=genre, format=fmt):
+                # Insert Genre
+                logger.debug("🔍 Inserting genre: %s", genre)
+                # 1 affected row = new genre (0 when it already existed)
+                genre_created = cursor.execute(
+                    "INSERT INTO Genre(name) VALUES(%s) ON DUPLICATE KEY UPDATE name=name", (genre,)) == 1
+                cursor.execute("SELECT genre_id FROM Genre WHERE name=%s", (genre,))
+                genre_result = cursor.fetchone()
+                logger.debug("🔍 Genre result: %s", genre_result)
+                if not genre_result:
+                    raise ValueError(f"Failed to create or find genre '{genre}'")
+                genre_id = genre_result['genre_id']
+                logger.debug("✅ Genre ID: %s", genre_id)
             
-            # Insert Format
-            cursor.execute("INSERT INTO Format(name) VALUES(%s) ON DUPLICATE KEY UPDATE name=name", (fmt,))
-            cursor.execute("SELECT format_id FROM Format WHERE name=%s", (fmt,))
-            format_result = cursor.fetchone()
-            if not format_result:
-                raise ValueError(f"Failed to create or find format '{fmt}'")
-            format_id = format_result['format_id']
+                # Insert Format
+                format_created = cursor.execute(
+                    "INSERT INTO Format(name) VALUES(%s) ON DUPLICATE KEY UPDATE name=name", (fmt,)) == 1
+                cursor.execute("SELECT format_id FROM Format WHERE name=%s", (fmt,))
+                format_result = cursor.fetchone()
+                if not format_result:
+                    raise ValueError(f"Failed to create or find format '{fmt}'")
+                format_id = format_result['format_id']
             
-            # Insert Book
-            cursor.execute("""
+            # Insert Book (1 affected row = inserted, 2 = updated)
+            book_rows = cursor.execute("""
                 INSERT INTO Book(isbn, title, publication_year, price, stock, genre_id, format_id)
                 VALUES(%s,%s,%s,%s,%s,%s,%s)
                 ON DUPLICATE KEY UPDATE title=VALUES(title), publication_year=VALUES(publication_year),
@@ -1151,23 +3612,33 @@ def insert_book():
             book_id = book_result['book_id']
 
             if validated_files:
-                uploaded_images = upload_images_to_gcs(isbn, validated_files)
-                new_objects = [img['object_name'] for img in uploaded_images]
-                old_objects = store_book_images(cursor, book_id, uploaded_images)
+                with trace_span('book.images', count=len(validated_files)):
+                    uploaded_images = upload_images_to_gcs(isbn, validated_files)
+                    new_objects = [img['object_name'] for img in uploaded_images]
+                    old_objects = store_book_images(cursor, book_id, uploaded_images)
             
-            # Insert Authors
-            for a in authors:
-                cursor.execute("INSERT INTO Author(name) VALUES(%s) ON DUPLICATE KEY UPDATE name=name", (a,))
-                cursor.execute("SELECT author_id FROM Author WHERE name=%s", (a,))
-                author_result = cursor.fetchone()
-                if not author_result:
-                    raise ValueError(f"Failed to create or find author '{a}'")
-                author_id = author_result['author_id']
-                # Insert into BookAuthor
-                cursor.execute("INSERT IGNORE INTO BookAuthor(book_id, author_id) VALUES(%s,%s)", (book_id, author_id))
+            with trace_span('book.authors', count=len(authors)):
+                # Insert Authors
+                for a in authors:
+                    cursor.execute("INSERT INTO Author(name) VALUES(%s) ON DUPLICATE KEY UPDATE name=name", (a,))
+                    cursor.execute("SELECT author_id FROM Author WHERE name=%s", (a,))
+                    author_result = cursor.fetchone()
+                    if not author_result:
+                        raise ValueError(f"Failed to create or find author '{a}'")
+                    author_id = author_result['author_id']
+                    # Insert into BookAuthor
+                    cursor.execute("INSERT IGNORE INTO BookAuthor(book_id, author_id) VALUES(%s,%s)", (book_id, author_id))
             
+            refresh_catalog_entries(cursor, [book_id])
+            cursor.execute("SELECT updated_at FROM BookCatalog WHERE book_id=%s", (book_id,))
+            version = encode_cursor(cursor.fetchone()['updated_at'])
             connection.commit()
-            cleanup_gcs_objects(old_objects)
+            mark_primary_write()
+            publish_book_event('insert' if book_rows == 1 else 'update', isbn, version)
+            if genre_created or format_created:
+                dimension_cache.bump()
+            with trace_span('book.cleanup_old_images', count=len(old_objects)):
+                cleanup_gcs_objects(old_objects)
     except ValueError as e:
         logger.warning("Validation error inserting book: %s", str(e))
         response = ET.Element("response")
@@ -1191,7 +3662,7 @@ def insert_book():
         ET.SubElement(response, "message").text = f"Database error: {str(e)}"
         return Response(ET.tostring(response, encoding="utf-8", xml_declaration=True), mimetype="application/xml"), 500
     finally:
-        connection.close()
+        db_pool.release(connection)
     
     response = ET.Element("response")
     ET.SubElement(response, "status").text = "success"
@@ -1199,6 +3670,7 @@ def insert_book():
 
 @app.route("/api/books/update", methods=["PUT"])
 @login_required
+@idempotent
 @swagger_doc({
     'tags': ['Books'],
     'summary': 'Actualizar un libro',
@@ -1212,6 +3684,13 @@ def insert_book():
             'required': True,
             'description': 'Bearer <token>'
         },
+        {
+            'name': 'Idempotency-Key',
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'Clave única por operación; los reintentos con la misma clave devuelven la respuesta original'
+        },
         {
             'name': 'book',
             'in': 'formData',
@@ -1279,8 +3758,10 @@ def delete_books():
     isbns = [i.text for i in root.findall("isbn")]
     
     objects_to_delete = []
-    connection = pymysql.connect(**DB_CONFIG)
+    deleted_events = []
+    connection = db_pool.acquire()
     try:
+        connection.begin()
         with connection.cursor() as cursor:
             for isbn in isbns:
                 # Obtener book_id
@@ -1290,43 +3771,134 @@ def delete_books():
                     book_id = res['book_id']
                     cursor.execute("SELECT object_name FROM BookImage WHERE book_id=%s", (book_id,))
                     objects_to_delete.extend([row['object_name'] for row in cursor.fetchall() if row.get('object_name')])
+                    cursor.execute("DELETE FROM BookCatalog WHERE book_id=%s", (book_id,))
+                    cursor.execute("INSERT INTO BookTombstone (book_id, isbn) VALUES (%s, %s)", (book_id, isbn))
+                    cursor.execute("SELECT deleted_at FROM BookTombstone WHERE seq=%s", (cursor.lastrowid,))
+                    deleted_events.append((isbn, encode_cursor(cursor.fetchone()['deleted_at'])))
                     cursor.execute("DELETE FROM BookAuthor WHERE book_id=%s", (book_id,))
                     cursor.execute("DELETE FROM Book WHERE book_id=%s", (book_id,))
             
             connection.commit()
+            mark_primary_write()
     finally:
-        connection.close()
+        db_pool.release(connection)
+    for isbn, version in deleted_events:
+        publish_book_event('delete', isbn, version)
     cleanup_gcs_objects(objects_to_delete)
     
     response = ET.Element("response")
     ET.SubElement(response, "status").text = "deleted"
     return Response(ET.tostring(response, encoding="utf-8", xml_declaration=True), mimetype="application/xml")
 
-@app.route("/api/formats", methods=["GET"])
-@login_required
-def get_formats():
-    """GET /api/formats → obtiene los formatos disponibles"""
+# ---------- DIMENSION CACHE ----------
+# /api/formats and /api/genres are served from rendered bytes kept per
+# worker. insert_book bumps `dimensions:version` and broadcasts on pub/sub
+# when it creates a Genre or Format; while the listener is connected cached
+# bodies are trusted, otherwise each request compares the version key.
+DIMENSIONS_CHANNEL = 'dimensions:events'
+DIMENSIONS_VERSION_KEY = 'dimensions:version'
+DIMENSION_CACHE_TTL = int(os.getenv('DIMENSION_CACHE_TTL', '60'))  # seconds, only used while Redis is down
+
+class DimensionCache:
+    """Per-worker cache of rendered dimension listings keyed by name."""
+
+    def __init__(self):
+        self._entries = {}  # name: (version, body, built_at)
+        self._generation = 0  # bumped on every invalidation
+        self._lock = threading.Lock()
+
+    def get(self, name, render):
+        redis_events.ensure_started()
+        entry = self._entries.get(name)
+        if entry is not None and redis_events.connected:
+            return entry[1]
+        generation = self._generation
+        try:
+            version = int(get_redis().get(DIMENSIONS_VERSION_KEY) or 0)
+        except Exception as e:
+            logger.warning("Dimension version check failed: %s", e)
+            if entry is not None and time.monotonic() - entry[2] < DIMENSION_CACHE_TTL:
+                return entry[1]
+            version = None
+        if entry is not None and version is not None and entry[0] == version:
+            return entry[1]
+        body = render()
+        with self._lock:
+            # An invalidation during render means `body` may already be stale
+            if generation == self._generation:
+                self._entries[name] = (version, body, time.monotonic())
+        return body
+
+    def bump(self):
+        """Invalidate every worker's cache after a Genre/Format was created"""
+        self.clear()
+        try:
+            version = get_redis().incr(DIMENSIONS_VERSION_KEY)
+        except Exception as e:
+            logger.error("Failed to bump dimension version: %s", e)
+            return
+        publish_event(DIMENSIONS_CHANNEL, {'version': version})
+
+    def on_message(self, _data):
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+dimension_cache = DimensionCache()
+redis_events.register(DIMENSIONS_CHANNEL, dimension_cache.on_message, dimension_cache.clear)
+
+def render_formats():
+    # Primary: a lagging replica would cache old rows under the new version
     sql = "SELECT format_id, name FROM Format"
-    formats = query_books(sql)
+    formats = query_db(sql)
     root = ET.Element("formats")
     for f in formats:
         f_el = ET.SubElement(root, "format")
         ET.SubElement(f_el, "id").text = str(f["format_id"])
         ET.SubElement(f_el, "name").text = f["name"]
-    return Response(ET.tostring(root), mimetype="application/xml")
+    return ET.tostring(root)
+
+def render_genres():
+    sql = "SELECT genre_id, name FROM Genre"
+    genres = query_db(sql)
+    root = ET.Element("genres")
+    for genre in genres:
+        genre_el = ET.SubElement(root, "genre")
+        ET.SubElement(genre_el, "id").text = str(genre["genre_id"])
+        ET.SubElement(genre_el, "name").text = genre["name"]
+    return ET.tostring(root)
+
+@app.route("/api/formats", methods=["GET"])
+@login_required
+def get_formats():
+    """GET /api/formats → obtiene los formatos disponibles"""
+    return Response(dimension_cache.get('formats', render_formats), mimetype="application/xml")
 
 @app.route("/api/genres", methods=["GET"])
 @login_required
 def get_genres():
     """GET /api/genres → obtiene los géneros disponibles"""
-    sql = "SELECT genre_id, name FROM Genre"
-    genres = query_books(sql)
-    root = ET.Element("genres")
-    for g in genres:
-        g_el = ET.SubElement(root, "genre")
-        ET.SubElement(g_el, "id").text = str(g["genre_id"])
-        ET.SubElement(g_el, "name").text = g["name"]
-    return Response(ET.tostring(root), mimetype="application/xml")
+    return Response(dimension_cache.get('genres', render_genres), mimetype="application/xml")
+
+# ---------- METRICS ENDPOINT ----------
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (metrics of the worker that answers)"""
+    gauges = [
+        ('db_pool_in_use', 'MySQL connections checked out', db_pool.in_use),
+        ('db_pool_size', 'MySQL pool capacity', db_pool.size),
+        ('db_pool_waiting', 'Requests waiting for a MySQL connection', db_pool.waiting),
+        ('password_hash_pending', 'Password hashing jobs queued or running', password_hasher.pending),
+        ('password_hash_capacity', 'Password hashing queue limit', password_hasher.max_pending),
+        ('sse_streams_open', 'Open /api/books/stream connections', book_events.count),
+        ('listing_cache_entries', 'Rendered listings cached in this worker', listing_cache.size),
+        ('log_records_dropped', 'Log records dropped because the log queue was full',
+         log_state['handler'].dropped if log_state['handler'] else 0),
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
 
 # ---------- ADMIN ENDPOINTS ----------
 @app.route('/api/admin/redis-status', methods=['GET'])
@@ -1356,24 +3928,196 @@ def redis_status():
             "error": str(e)
         }), 500
 
+@app.route('/api/admin/slow-requests', methods=['GET'])
+@login_required
+@admin_required
+def slow_requests_report():
+    """Span trees of the slowest recent requests of this worker
+
+    Query params: limit (most recent N, default 20) and min_ms (only
+    requests at least this slow).
+    """
+    limit = min(request.args.get('limit', 20, type=int), SLOW_REQUEST_BUFFER)
+    min_ms = request.args.get('min_ms', 0, type=float)
+    entries = [e for e in list(slow_requests) if e['duration_ms'] >= min_ms]
+    return jsonify({
+        "threshold_ms": SLOW_REQUEST_MS,
+        "buffer_size": SLOW_REQUEST_BUFFER,
+        "worker_pid": os.getpid(),
+        "requests": list(reversed(entries))[:limit]
+    }), 200
+
+@app.route('/api/admin/redis-memory', methods=['GET'])
+@login_required
+@admin_required
+def redis_memory_report():
+    """Estimate Redis memory per key prefix from a SCAN sample
+
+    Query params: sample (keys scanned, default 2000) and per_prefix
+    (keys measured with MEMORY USAGE per prefix, default 50).
+    """
+    sample_size = min(request.args.get('sample', 2000, type=int), 100000)
+    per_prefix = min(request.args.get('per_prefix', 50, type=int), 1000)
+
+    try:
+        r = get_redis()
+        total_keys = r.dbsize()
+        sampled = 0
+        prefixes = {}
+        for keys in scan_batches(r, '*', 500):
+            for key in keys:
+                prefix = key.split(':', 1)[0]
+                prefixes.setdefault(prefix, {'sampled': 0, 'keys': []})
+                prefixes[prefix]['sampled'] += 1
+                if len(prefixes[prefix]['keys']) < per_prefix:
+                    prefixes[prefix]['keys'].append(key)
+            sampled += len(keys)
+            if sampled >= sample_size:
+                break
+
+        report = {}
+        for prefix, data in prefixes.items():
+            pipe = r.pipeline(transaction=False)
+            for key in data['keys']:
+                pipe.memory_usage(key, samples=0)
+            pipe.object('encoding', data['keys'][0])
+            results = pipe.execute()
+            sizes = [size for size in results[:-1] if size]
+            avg_bytes = sum(sizes) / len(sizes) if sizes else 0
+            estimated_keys = int(total_keys * data['sampled'] / sampled) if sampled else 0
+            report[prefix] = {
+                "sampled_keys": data['sampled'],
+                "measured_keys": len(sizes),
+                "encoding": results[-1],
+                "avg_bytes": round(avg_bytes, 1),
+                "estimated_keys": estimated_keys,
+                "estimated_bytes": int(avg_bytes * estimated_keys)
+            }
+
+        return jsonify({
+            "total_keys": total_keys,
+            "sampled_keys": sampled,
+            "used_memory": r.info('memory').get('used_memory'),
+            "prefixes": report
+        }), 200
+    except Exception as e:
+        return jsonify({"msg": f"Error building memory report: {str(e)}"}), 500
+
 @app.route('/api/admin/clear-rate-limits', methods=['POST'])
+@login_required
+@admin_required
 def clear_rate_limits():
-    """Clear all rate limit keys from Redis"""
+    """Clear all rate limit keys from Redis (?async=1 runs it in the background)"""
     if not redis_available():
         return jsonify({"msg": "Redis not available"}), 503
-    
+
+    if request.args.get('async') == '1':
+        job = start_maintenance_job('clear-rate-limits', clear_rate_limit_keys)
+        return jsonify({
+            "msg": "Clearing rate limit keys",
+            "job": job.to_dict(),
+            "status_url": f"/api/admin/maintenance/{job.id}"
+        }), 202
+
+    job = run_maintenance_job('clear-rate-limits', clear_rate_limit_keys)
+    if job.status == 'failed':
+        return jsonify({"msg": f"Error clearing rate limits: {job.error}"}), 500
+    if job.removed:
+        return jsonify({"msg": f"Cleared {job.removed} rate limit keys"})
+    return jsonify({"msg": "No rate limit keys found"})
+
+@app.route('/api/admin/purge-user-tokens', methods=['POST'])
+@login_required
+@admin_required
+def purge_user_tokens():
+    """Remove expired token hashes from the per-user token sets"""
+    if not redis_available():
+        return jsonify({"msg": "Redis not available"}), 503
+
+    job = start_maintenance_job('purge-user-tokens', purge_user_token_sets)
+    return jsonify({
+        "msg": "Purging expired user token entries",
+        "job": job.to_dict(),
+        "status_url": f"/api/admin/maintenance/{job.id}"
+    }), 202
+
+@app.route('/api/admin/catalog/rebuild', methods=['POST'])
+@login_required
+@admin_required
+def rebuild_catalog_endpoint():
+    """Recompute the BookCatalog read model in the background"""
+    job = start_maintenance_job('rebuild-catalog', rebuild_catalog)
+    return jsonify({
+        "msg": "Rebuilding book catalog",
+        "job": job.to_dict(),
+        "status_url": f"/api/admin/maintenance/{job.id}"
+    }), 202
+
+@app.route('/api/admin/maintenance', methods=['GET'])
+@login_required
+@admin_required
+def list_maintenance_jobs():
+    """List recent maintenance jobs and their progress"""
+    with maintenance_jobs_lock:
+        jobs = [job.to_dict() for job in maintenance_jobs.values()]
+    return jsonify({"jobs": jobs})
+
+@app.route('/api/admin/maintenance/<job_id>', methods=['GET'])
+@login_required
+@admin_required
+def maintenance_job_status(job_id):
+    """Report progress of a maintenance job"""
+    job = maintenance_jobs.get(job_id)
+    if job:
+        return jsonify(job.to_dict())
+    # Started by another worker: read the progress it reported
     try:
-        r = get_redis()
-        # Clear all rate limit keys
-        keys = r.keys("rate_limit*")
-        if keys:
-            r.delete(*keys)
-            return jsonify({"msg": f"Cleared {len(keys)} rate limit keys"})
-        else:
-            return jsonify({"msg": "No rate limit keys found"})
-    except Exception as e:
-        return jsonify({"msg": f"Error clearing rate limits: {str(e)}"}), 500
+        data = get_redis().get(f"maintenance:job:{job_id}")
+    except Exception:
+        data = None
+    if not data:
+        return jsonify({"msg": "Job not found"}), 404
+    return jsonify(json.loads(data))
+
+# ---------- APP FACTORY ----------
+def init_worker():
+    """(Re)create per-process resources: the log listener, the MySQL pool
+    and the Redis client.
+
+    Called by create_app and, with a preloading prefork server, once in each
+    worker right after fork so no socket is shared between processes.
+    Background threads restart on their own (they check the pid).
+    """
+    global db_pool, redis_client, read_router
+    start_log_listener()
+    # Inherited connections belong to the parent; drop them without closing
+    db_pool = MySQLPool(DB_CONFIG, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+    read_router = ReadRouter(DB_REPLICAS)
+    redis_client = None  # re-created on first use
+    redis_health['checked_at'] = float('-inf')
+    hybrid_rate_limiter.reset()
+    denylist_replica.mark_stale()
+    token_generations.clear()
+    dimension_cache.clear()
+    listing_cache.clear()
+
+def shutdown_worker():
+    """Release process-level resources before a worker exits"""
+    password_hasher.shutdown()
+    refresh_token_gc.stop()
+    health_prober.stop()
+    tombstone_gc.stop()
+    listing_cache.shutdown()
+    stop_log_listener()
+
+def create_app(config=None):
+    """Return the configured Flask app with fresh per-process resources"""
+    if config:
+        app.config.update(config)
+    init_swagger()
+    init_worker()
+    return app
 
 # ---------- RUN ----------
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5003, debug=True)
+    create_app().run(host='0.0.0.0', port=5003, debug=True)
@@ -0,0 +1,23 @@
+-- Refresh tokens are stored as a fixed-width SHA-256 digest with a unique
+-- index instead of the full JWT, so logout is an index lookup. The
+-- expires_at / revoked indexes keep the garbage collector's batched
+-- DELETEs on index ranges.
+--
+-- Apply after importing Libros_dump.sql:
+--   mysql -u libros_user -p Libros < migrations/001_refresh_tokens_hash.sql
+
+ALTER TABLE `refresh_tokens`
+  ADD COLUMN `token_hash` binary(32) DEFAULT NULL AFTER `user_id`;
+
+UPDATE `refresh_tokens` SET `token_hash` = UNHEX(SHA2(`refresh_token`, 256));
+
+-- Identical JWTs (same user, same second) collapse into one row
+DELETE t1 FROM `refresh_tokens` t1
+  JOIN `refresh_tokens` t2 ON t1.`token_hash` = t2.`token_hash` AND t1.`id` > t2.`id`;
+
+ALTER TABLE `refresh_tokens`
+  DROP COLUMN `refresh_token`,
+  MODIFY `token_hash` binary(32) NOT NULL,
+  ADD UNIQUE KEY `token_hash` (`token_hash`),
+  ADD KEY `expires_at` (`expires_at`),
+  ADD KEY `revoked_expires_at` (`revoked`, `expires_at`);
@@ -0,0 +1,43 @@
+-- Denormalized read model for the book listings. One row per book with the
+-- genre and format names, the author string and the image count inlined, so
+-- listing endpoints read a single table instead of grouping the
+-- Book/Genre/Format/BookAuthor/Author join on every request.
+--
+-- insert_book and delete_books keep it up to date in the same transaction
+-- as the base tables; POST /api/admin/catalog/rebuild recomputes it.
+--
+-- Apply after 001_refresh_tokens_hash.sql:
+--   mysql -u libros_user -p Libros < migrations/002_book_catalog.sql
+
+CREATE TABLE `BookCatalog` (
+  `book_id` int(11) NOT NULL,
+  `isbn` varchar(20) NOT NULL,
+  `title` varchar(255) NOT NULL,
+  `publication_year` int(11) NOT NULL,
+  `price` decimal(6,2) DEFAULT NULL,
+  `stock` tinyint(1) DEFAULT NULL,
+  `genre_id` int(11) DEFAULT NULL,
+  `format_id` int(11) DEFAULT NULL,
+  `genre` varchar(100) DEFAULT NULL,
+  `format` varchar(50) DEFAULT NULL,
+  `author_names` text DEFAULT NULL,
+  `image_count` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`book_id`),
+  UNIQUE KEY `isbn` (`isbn`),
+  KEY `format` (`format`),
+  KEY `genre` (`genre`),
+  CONSTRAINT `fk_catalog_book` FOREIGN KEY (`book_id`) REFERENCES `Book` (`book_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=latin1 COLLATE=latin1_swedish_ci;
+
+INSERT INTO `BookCatalog`
+  (book_id, isbn, title, publication_year, price, stock, genre_id, format_id,
+   genre, format, author_names, image_count)
+SELECT b.book_id, b.isbn, b.title, b.publication_year, b.price, b.stock, b.genre_id, b.format_id,
+       g.name, f.name,
+       (SELECT GROUP_CONCAT(a.name ORDER BY ba.author_id SEPARATOR ', ')
+          FROM BookAuthor ba JOIN Author a ON a.author_id = ba.author_id
+         WHERE ba.book_id = b.book_id),
+       (SELECT COUNT(*) FROM BookImage bi WHERE bi.book_id = b.book_id)
+FROM Book b
+LEFT JOIN Genre g ON b.genre_id = g.genre_id
+LEFT JOIN Format f ON b.format_id = f.format_id;
@@ -0,0 +1,24 @@
+-- Composite indexes for GET /api/books/search on BookCatalog. Each equality
+-- filter (genre, format) is paired with the range/sort column that usually
+-- follows it, so "genre + year range + sort by year" or "format + sort by
+-- price" resolve as one index range scan without a filesort. InnoDB appends
+-- book_id to every secondary index, which covers the tie-breaker of each
+-- ORDER BY. The single-column genre/format keys from 002 become prefixes of
+-- the new ones and are dropped.
+--
+-- bench_search_plans.py runs EXPLAIN on representative searches and fails
+-- if a plan stops using these indexes.
+--
+-- Apply after 002_book_catalog.sql:
+--   mysql -u libros_user -p Libros < migrations/003_book_catalog_search_indexes.sql
+
+ALTER TABLE `BookCatalog`
+  DROP KEY `format`,
+  DROP KEY `genre`,
+  ADD KEY `genre_year` (`genre`, `publication_year`),
+  ADD KEY `genre_price` (`genre`, `price`),
+  ADD KEY `format_year` (`format`, `publication_year`),
+  ADD KEY `format_price` (`format`, `price`),
+  ADD KEY `publication_year` (`publication_year`),
+  ADD KEY `price` (`price`),
+  ADD KEY `title` (`title`);
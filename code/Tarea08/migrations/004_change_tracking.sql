@@ -0,0 +1,31 @@
+-- Change tracking for GET /api/books/changes?since=<cursor>.
+--
+-- Book and BookImage get an updated_at maintained by MySQL. BookCatalog's
+-- updated_at is what the endpoint reads: insert_book touches it explicitly
+-- (an image replacement changes no catalog column), while the admin rebuild
+-- only moves it when a recomputed value actually differs. Deletions leave a
+-- row in BookTombstone; tombstones older than CHANGES_RETENTION_DAYS are
+-- purged, and cursors older than that must resync from /api/books.
+--
+-- Apply after 003_book_catalog_search_indexes.sql:
+--   mysql -u libros_user -p Libros < migrations/004_change_tracking.sql
+
+ALTER TABLE `Book`
+  ADD COLUMN `updated_at` datetime(6) NOT NULL DEFAULT current_timestamp(6) ON UPDATE current_timestamp(6),
+  ADD KEY `updated_at` (`updated_at`);
+
+ALTER TABLE `BookImage`
+  ADD COLUMN `updated_at` datetime(6) NOT NULL DEFAULT current_timestamp(6) ON UPDATE current_timestamp(6);
+
+ALTER TABLE `BookCatalog`
+  ADD COLUMN `updated_at` datetime(6) NOT NULL DEFAULT current_timestamp(6) ON UPDATE current_timestamp(6),
+  ADD KEY `updated_at` (`updated_at`);
+
+CREATE TABLE `BookTombstone` (
+  `seq` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+  `book_id` int(11) NOT NULL,
+  `isbn` varchar(20) NOT NULL,
+  `deleted_at` datetime(6) NOT NULL DEFAULT current_timestamp(6),
+  PRIMARY KEY (`seq`),
+  KEY `deleted_at` (`deleted_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1 COLLATE=latin1_swedish_ci;